@@ -1,4 +1,4 @@
-from flask import Flask, request, send_file
+from flask import Flask, Response, request, send_file, stream_with_context
 from models import (
     DynamicModel,
     Train,
@@ -6,32 +6,94 @@ from models import (
     TransformerData,
     TransformerTrain,
     Inference,
+    TRANSFORMER_DATA,
 )
 from flask_cors import CORS
 from generate import Generate
+from checkpoint import load_spec
+from executor import ProcessExecutor
+from jobs import JobQueue, QueueFullError
+from params import DATALOADERS
+from runners import RNG_LOCK, RUNNERS, run_train, run_transformer_train
+from weight_store import WEIGHTS
+from batched import BATCH_RUNNERS
+from result_cache import RESULT_CACHE
+from preflight import preflight
+from compile_cache import COMPILE_CACHE
 
 # dumb imports that i gyatt to add
 import torch
 import torch.nn as nn
 from torch.utils.data import Dataset, DataLoader
-from torchvision import datasets, transforms
-from torchvision.transforms import ToTensor
 from torch.utils.data import DataLoader, TensorDataset
 import torch.nn.functional as F
-from sklearn.model_selection import train_test_split  # --> pip install scikit-learn
 import math
 from collections import Counter
+import json
+import os
+import time
 
 
 app = Flask(__name__)
 CORS(app)
 
+# training jobs submitted with "async": true run here, a couple at a time. set at deploy time:
+#   JOB_BACKEND=thread   --> inside this process (default)
+#   JOB_BACKEND=process  --> in warm worker processes, each with its own share of the cores
+#   JOB_WORKERS=n        --> jobs running at once (default 2 threads / one process per core)
+#   JOB_THREADS_PER_WORKER=n, JOB_PIN_CPUS=1  --> torch threads + core pinning of each process
+JOB_BACKEND = os.environ.get("JOB_BACKEND", "thread")
+JOB_WORKERS = int(os.environ["JOB_WORKERS"]) if os.environ.get("JOB_WORKERS") else None
+if JOB_BACKEND == "process":
+    executor = ProcessExecutor(
+        max_workers=JOB_WORKERS,
+        threads_per_worker=int(os.environ.get("JOB_THREADS_PER_WORKER", 0)) or None,
+        pin_cpus=os.environ.get("JOB_PIN_CPUS", "0") == "1",
+    )
+    jobs = JobQueue(
+        RESULT_CACHE.wrap(executor.runners(RUNNERS)),  # cache lives here, in front of the workers
+        max_workers=executor.max_workers,
+        max_queued=64,
+        # a batched group is one vectorized run, it stays in this process
+        batch_runners=RESULT_CACHE.wrap_batch(BATCH_RUNNERS),
+    )
+elif JOB_BACKEND == "thread":
+    jobs = JobQueue(
+        RESULT_CACHE.wrap(RUNNERS),
+        max_workers=JOB_WORKERS or 2,
+        max_queued=64,
+        batch_runners=RESULT_CACHE.wrap_batch(BATCH_RUNNERS),
+    )
+else:
+    raise ValueError(f"JOB_BACKEND must be 'thread' or 'process', not {JOB_BACKEND!r}")
+
 
 @app.route("/")
 def hello_world():
     return {"data": "hello"}
 
 
+@app.route("/datasets")
+def dataset_stats():
+    # which datasets are materialized in this process + how long each took to load
+    return {
+        "datasets": DATALOADERS.stats(),
+        "transformer_data": TRANSFORMER_DATA.stats(),
+    }
+
+
+@app.route("/cache/stats")
+def cache_stats():
+    # hit rate + training time saved by the result cache, and architectures compiled for "compile": true
+    return dict(RESULT_CACHE.stats(), compiled=COMPILE_CACHE.stats())
+
+
+@app.route("/weights")
+def weight_stats():
+    # finished job weights kept for "warm_start"
+    return WEIGHTS.stats()
+
+
 @app.route("/generate", methods=["POST"])
 def generate():
     data = request.get_json()
@@ -67,31 +129,31 @@ def train():
 #     "batch_size": 64,
 # }
 
-    data = request.get_json()
+    data = request.get_json(silent=True)  # None if it isn't JSON, preflight() reports that
     print("Received data:", data)
 
-    inp = data["input"]
-    layers = data["layers"]
-    loss = data["loss"]
-    optimizer = data["optimizer"]
-    n_epochs = data["epoch"]
-    batch_size = data["batch_size"]
+    # shape / size check on meta tensors, before a worker or the dataset is touched
+    try:
+        report = preflight(data)
+    except Exception as e:  # anything preflight() doesn't validate itself is still a bad request
+        return {"status": "failed", "error": f"Invalid request: {e}"}, 400
+    if not report["ok"]:
+        return {"status": "failed", "error": "; ".join(report["errors"]), "preflight": report}, 422
+
+    if data.get("stream"):  # send metrics as they come in
+        return stream_job("train", data)
+    # queue it and hand back a job id right away. checkpointed runs always do, the id is what
+    # /jobs/<id>/resume needs after a crash
+    if data.get("async") or data.get("checkpoint"):
+        return submit_job("train", data)
+    if data.get("batch"):  # wait for other students' identical models and train them together
+        return wait_job("train", data)
 
     RESULTS = {}
 
     try:
-        model = DynamicModel(layers)
-
-        t = Train(
-            model=model,
-            input=inp,
-            loss=loss,
-            optimizer=optimizer,
-            batch_size=batch_size,
-        )
-
-        print("slay... model initialized successfully!")
-        RESULTS = t.train_test_log(n_epochs, batch_size)
+        # identical requests (incl. "seed") are answered from the cache / share one run
+        RESULTS = RESULT_CACHE.run("train", data, lambda: run_train(data))
 
     except Exception as e:
         print("Error:", e)
@@ -102,6 +164,16 @@ def train():
     }  # training loss
 
 
+@app.post("/preflight")
+def preflight_check():
+    # same payload as /train: per-layer shapes, params, FLOPs, memory + whether /train would accept it
+    data = request.get_json(silent=True)
+    try:
+        return preflight(data)
+    except Exception as e:
+        return {"ok": False, "errors": [str(e)]}
+
+
 @app.post("/transformertrain")  # MODEL IS MOVED TO DEVICE INSIDE OF TRAIN FUNCTION
 def transformertrain():
     # # example arguments
@@ -125,33 +197,13 @@ def transformertrain():
     data = request.get_json()
     print("Received data:", data)
 
-    inp = data["input"]
-    layers = data["layers"]
-    loss = data["loss"]
-    optimizer = data["optimizer"]
-    n_epochs = data["epoch"]
-    batch_size = data["batch_size"]
+    if data.get("stream"):  # send metrics as they come in
+        return stream_job("transformertrain", data)
+    if data.get("async") or data.get("checkpoint"):  # job id first, see /train
+        return submit_job("transformertrain", data)
 
     try:
-        if torch.cuda.is_available():
-            torch.cuda.empty_cache()  # clear GPU memory
-
-        dataset = TransformerData(inp)
-        model = TransformerModel(
-            layers, dataset.vocab_size, dataset.sequence_length
-        )  # model is moved to device in train function
-
-        t = TransformerTrain(
-            model=model,
-            inp=inp,
-            loss=loss,
-            optimizer=optimizer,
-            batch_size=batch_size,
-        )
-
-        print("it worked!")
-
-        RESULTS = t.train(n_epochs)
+        RESULTS = RESULT_CACHE.run("transformertrain", data, lambda: run_transformer_train(data))
 
     except Exception as e:
         print("Error:", e)
@@ -162,6 +214,100 @@ def transformertrain():
     }
 
 
+def submit_job(kind, data):
+    try:
+        job = jobs.submit(kind, data)
+    except QueueFullError as e:
+        return {"status": "failed", "error": str(e)}, 503
+    return {"job_id": job.id, "status": job.status}, 202
+
+
+def wait_job(kind, data):
+    # synchronous request that still goes through the job queue (e.g. to be batched with others)
+    try:
+        job = jobs.submit(kind, data)
+    except QueueFullError as e:
+        return {"status": "failed", "error": str(e)}, 503
+    while job.status not in ("done", "failed"):
+        time.sleep(0.05)
+    if job.status == "failed":
+        return {"RESULTS": {"error": job.error}}
+    return {"RESULTS": job.result}
+
+
+def stream_job(kind, data):
+    # runs the request as a job and streams its metrics back as they are recorded:
+    #   "stream": "sse"      --> Server-Sent Events
+    #   "stream": "ndjson"   --> one JSON object per line (anything else truthy means this too)
+    #   "emit_every": n      --> only send every n-th epoch (batch events come from "log_every")
+    try:
+        job = jobs.submit(kind, data)
+    except QueueFullError as e:
+        return {"status": "failed", "error": str(e)}, 503
+
+    sse = data["stream"] == "sse"
+    emit_every = max(int(data.get("emit_every", 1)), 1)
+
+    def encode(event):
+        line = json.dumps(event)
+        return f"data: {line}\n\n" if sse else line + "\n"
+
+    def events():
+        yield encode({"event": "job", "job_id": job.id})
+        sent = 0
+        while True:
+            finished = job.status in ("done", "failed")  # check before reading metrics so none are missed
+            metrics = job.metrics[sent:]
+            sent += len(metrics)
+            for m in metrics:
+                if m.get("event") != "epoch" or m["epoch"] % emit_every == 0:
+                    yield encode(m)
+            if finished:
+                break
+            time.sleep(0.1)  # polls the job, never touches the training loop
+        if job.status == "done":
+            yield encode({"event": "done", "RESULTS": job.result})
+        else:
+            yield encode({"event": "error", "error": job.error})
+
+    return Response(
+        stream_with_context(events()),
+        mimetype="text/event-stream" if sse else "application/x-ndjson",
+    )
+
+
+@app.route("/jobs")
+def list_jobs():
+    # queue depth + wait/run time of every job we still remember
+    return jobs.stats()
+
+
+@app.route("/jobs/<job_id>")
+def job_status(job_id):
+    # status, per-epoch metrics so far, and RESULTS once it's done
+    job = jobs.get(job_id)
+    if job is None:
+        return {"status": "failed", "error": f"Unknown job {job_id}"}, 404
+    return job.to_dict()
+
+
+@app.post("/jobs/<job_id>/resume")
+def resume_job(job_id):
+    # re-run a job that was checkpointed ("checkpoint" in its request) from its last checkpoint,
+    # e.g. after the server restarted. The job keeps its id
+    job = jobs.get(job_id)
+    if job is not None and job.status in ("queued", "running"):
+        return {"status": "failed", "error": f"Job {job_id} is still {job.status}"}, 409
+    spec = load_spec(job_id)
+    if spec is None:
+        return {"status": "failed", "error": f"No checkpoint for job {job_id}"}, 404
+    try:
+        job = jobs.submit(spec["kind"], dict(spec["data"], resume=True), job_id=job_id)
+    except QueueFullError as e:
+        return {"status": "failed", "error": str(e)}, 503
+    return {"job_id": job.id, "status": job.status}, 202
+
+
 @app.post("/transformertest")  # MODEL IS MOVED TO DEVICE INSIDE OF INFERENCE FUNCTION
 def transformertest():
     infer_data = request.get_json()
@@ -175,9 +321,9 @@ def transformertest():
     # example data
     data = {
         "input": "alice",  # preprocess
-        "layers": [
-            {"kind": "Decoder", "args": (embed_dim, heads, hidden_dim)},
-            {"kind": "Decoder", "args": (embed_dim, heads, hidden_dim)},
+        "layers": [  # model2.pth was trained with the self + cross attention layers
+            {"kind": "LegacyDecoder", "args": (embed_dim, heads, hidden_dim)},
+            {"kind": "LegacyDecoder", "args": (embed_dim, heads, hidden_dim)},
             {"kind": "Output", "args": 0.3},
         ],
         "loss": "CrossEntropy",
@@ -197,32 +343,28 @@ def transformertest():
     # hardcode example decoder model for now
 
     try:
-        dataset = TransformerData(data["input"])
-        
+        dataset = TRANSFORMER_DATA[data["input"]]  # cached, no re-tokenizing per request
+
         if torch.cuda.is_available():
             torch.cuda.empty_cache()  # clear GPU memory
 
-        model = TransformerModel(
-            data["layers"], dataset.vocab_size, dataset.sequence_length
-        )
+        with RNG_LOCK.shared():  # init + sampling draw from the RNGs a seeded training run owns
+            model = TransformerModel(
+                data["layers"], dataset.vocab_size, dataset.sequence_length
+            )
 
-        device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+            device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 
-        model.load_state_dict(torch.load("datasets/model2.pth", weights_only=True, map_location=device))
-        
+            model.load_state_dict(torch.load("datasets/model2.pth", weights_only=True, map_location=device))
 
-        print("Model loaded successfully!")
+            print("Model loaded successfully!")
 
-        word_to_int = dataset.word_to_int
-        int_to_word = dataset.int_to_word
-        SEQUENCE_LENGTH = dataset.sequence_length
-        
-        model.to(device) # move model to device
+            model.to(device) # move model to device
 
-        text_gen = Inference(model, word_to_int, int_to_word, SEQUENCE_LENGTH)
-        sample = text_gen.generate_text(
-            prompt, generate_length, temperature=temperature, top_k=None
-        )
+            text_gen = Inference(model, dataset=dataset)
+            sample = text_gen.generate_text(
+                prompt, generate_length, temperature=temperature, top_k=None
+            )
 
         RESULTS = {"text": sample}
 
@@ -0,0 +1,103 @@
+import json
+import os
+import socket
+import threading
+import time
+
+import torch
+from torch.utils.data import DataLoader
+
+from executor import available_cores
+from files import write_atomic
+
+# best DataLoader settings found so far, per (dataset, batch_size, host)
+CACHE_PATH = "data/loader_tuning.json"
+
+_lock = threading.Lock()
+
+
+def host_key():
+    # settings that win on one machine don't carry over to another
+    return f"{socket.gethostname()}/{available_cores()}cpu/{'cuda' if torch.cuda.is_available() else 'nocuda'}"
+
+
+def candidate_settings():
+    """Small grid of loader settings worth trying on this machine."""
+    cores = available_cores()
+    pin = [False, True] if torch.cuda.is_available() else [False]
+    settings = [{"num_workers": 0, "pin_memory": p} for p in pin]
+    for workers in (2, 4):
+        if workers > cores:
+            continue
+        for prefetch in (2, 4):
+            for p in pin:
+                settings.append(
+                    {
+                        "num_workers": workers,
+                        "pin_memory": p,
+                        "persistent_workers": True,
+                        "prefetch_factor": prefetch,
+                    }
+                )
+    return settings
+
+
+def time_loader(dataset, batch_size, settings, n_batches, loader_kwargs):
+    loader = DataLoader(dataset, batch_size=batch_size, **settings, **loader_kwargs)
+    start = time.perf_counter()
+    for i, _ in enumerate(loader):  # worker start up counts, short jobs pay for it too
+        if i + 1 >= n_batches:
+            break
+    return time.perf_counter() - start
+
+
+def _read_cache():
+    if not os.path.exists(CACHE_PATH):
+        return {}
+    with open(CACHE_PATH, "r") as file:
+        return json.load(file)
+
+
+def _write_cache(cache):
+    os.makedirs(os.path.dirname(CACHE_PATH), exist_ok=True)
+    write_atomic(CACHE_PATH, lambda f: f.write(json.dumps(cache, indent=2).encode("utf-8")))
+
+
+def tuned_loader_settings(dataset, batch_size, dataset_key, n_batches=200, **loader_kwargs):
+    """
+    Fastest DataLoader settings for this dataset + batch size on this host. The
+    grid is only benchmarked the first time, later calls read the decision from
+    CACHE_PATH.
+
+    :param dataset: Dataset the loader will wrap.
+    :param batch_size: Batch size of the job.
+    :param dataset_key: Name for the dataset in the cache (e.g. "MNIST").
+    :param n_batches: Batches timed per candidate.
+    :param loader_kwargs: Other DataLoader arguments the job uses (sampler, collate_fn, ...).
+    """
+    key = f"{dataset_key}|{batch_size}|{host_key()}"
+    with _lock:  # one tuning run at a time, they'd skew each other's timings anyway
+        cache = _read_cache()
+        if key in cache:
+            return cache[key]["settings"]
+
+        timings = []
+        for settings in candidate_settings():
+            try:
+                seconds = time_loader(dataset, batch_size, settings, n_batches, loader_kwargs)
+            except Exception as e:  # e.g. dataset that can't be sent to worker processes
+                print(f"Loader settings {settings} failed: {e}")
+                continue
+            timings.append((seconds, settings))
+        seconds, best = min(timings, key=lambda t: t[0])
+        print(f"Tuned loader for {key}: {best} ({seconds:.2f}s for {n_batches} batches)")
+
+        cache = _read_cache()  # another process may have written in the meantime
+        cache[key] = {
+            "settings": best,
+            "seconds": seconds,
+            "n_batches": n_batches,
+            "timings": [{"settings": s, "seconds": t} for t, s in timings],
+        }
+        _write_cache(cache)
+        return best
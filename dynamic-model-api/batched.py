@@ -0,0 +1,257 @@
+import copy
+import json
+import time
+
+import torch
+from torch.func import functional_call, stack_module_state, vmap
+from torch.utils.data import DataLoader
+
+from models import DynamicModel, Train
+from params import OPTIMIZERS
+from runners import finish, seeded, warm_start
+from stopping import StoppingPolicy
+
+# "batch": true train requests that arrive within the job queue's batching window and have
+# the same layers, loss, optimizer, ... are trained as one model with a leading "which job"
+# dimension on every parameter, instead of one Python loop per job
+
+BATCHABLE_INPUTS = ("pima",)  # small tabular data, the whole split fits on the device at once
+# request keys that have to match within a group, with their defaults
+_GROUP_BY = {
+    "input": None,
+    "layers": None,
+    "loss": None,
+    "optimizer": None,
+    "epoch": None,
+    "batch_size": None,
+    "eval_every": 1,
+    "eval_subsample": None,
+}
+# seeded requests expect the exact RESULTS of their own run, warm starts each train a different
+# number of epochs
+_NOT_BATCHABLE = (
+    "stopping", "checkpoint", "resume", "fast_data", "autotune_loader", "seed", "compile", "warm_start"
+)
+
+
+def batch_key(data):
+    # requests with the same key can share one vectorized run, None if this one can't be batched
+    if data.get("input") not in BATCHABLE_INPUTS or any(data.get(k) for k in _NOT_BATCHABLE):
+        return None
+    return json.dumps({k: data.get(k, default) for k, default in _GROUP_BY.items()}, sort_keys=True)
+
+
+def _tensors(dataset):
+    # the whole (Tensor)Dataset / Subset as one batch
+    return next(iter(DataLoader(dataset, batch_size=len(dataset))))
+
+
+class BatchedTrain:
+    """
+    Trains several DynamicModels with identical layers at once. Their parameters
+    are stacked along a new first dimension and every step runs all models
+    through torch.func.vmap, so the Python loop runs once per batch instead of
+    once per batch per model. Every model still gets its own init, its own
+    shuffle order and dropout masks, and its own optimizer state.
+
+    :param models: DynamicModels built from the same layers.
+    :param input: Dataset name, see BATCHABLE_INPUTS.
+    :param loss: Loss name (same for all models).
+    :param optimizer: {"kind", "lr"} (same for all models).
+    :param batch_size: Batch size of every model.
+    """
+
+    def __init__(self, models, input, loss, optimizer, batch_size, eval_every=1, eval_subsample=None):
+        # a Train for the first model gives us the exact split, test subsample and loss the
+        # unbatched path would use
+        reference = Train(
+            models[0],
+            input,
+            loss,
+            optimizer,
+            batch_size,
+            eval_every=eval_every,
+            eval_subsample=eval_subsample,
+        )
+        self.input = input
+        self.device = reference.device
+        self.loss_fn = reference.loss_fn
+        self.eval_every = eval_every
+        self.eval_policy = reference.eval_policy
+        self.batch_size = batch_size
+        self.X_train, self.y_train = (t.to(self.device) for t in _tensors(reference.train_loader.dataset))
+        self.X_test, self.y_test = (t.to(self.device) for t in _tensors(reference.test_loader.dataset))
+
+        self.models = [m.to(self.device) for m in models]
+        self.params, self.buffers = stack_module_state(self.models)  # {name: [n_models, ...]}
+        self.base = copy.deepcopy(self.models[0]).to("meta")  # only its structure is used
+        # elementwise optimizers (Adam, SGD, ...) on stacked tensors == one optimizer per model
+        self.optimizer = OPTIMIZERS[optimizer["kind"]](self.params.values(), optimizer["lr"])
+
+    def forward(self, params, buffers, X):
+        return functional_call(self.base, (params, buffers), (X,))
+
+    def predicted(self, pred):
+        if self.input == "pima":
+            return (pred > 0.5).float()  # binary classification
+        return pred.argmax(-1)
+
+    def run_batch(self, X, y, in_dims):
+        # pred + loss of every model, X/y are either per model (0) or shared (None)
+        def one_model(params, buffers, X, y):
+            pred = self.forward(params, buffers, X)
+            return self.loss_fn(pred, y), pred
+
+        return vmap(one_model, in_dims=(0, 0) + in_dims, randomness="different")(
+            self.params, self.buffers, X, y
+        )
+
+    def count_correct(self, pred, y):
+        # [n_models] correct predictions
+        return (self.predicted(pred) == y).flatten(1).sum(1)
+
+    def train(self, stopping):
+        n_models, n = len(self.models), len(self.X_train)
+        self.base.train()
+        loss_sum = torch.zeros(n_models, device=self.device)
+        correct = torch.zeros(n_models, device=self.device)
+        batches = total = 0
+        # a different shuffle for every model, like separate DataLoaders would give
+        order = torch.rand(n_models, n, device=self.device).argsort(dim=1)
+        for start in range(0, n, self.batch_size):
+            idx = order[:, start : start + self.batch_size]
+            X, y = self.X_train[idx], self.y_train[idx]  # [n_models, batch, ...]
+            losses, pred = self.run_batch(X, y, (0, 0))
+            losses.sum().backward()  # models don't share parameters, so each gets its own gradient
+            self.optimizer.step()
+            self.optimizer.zero_grad()
+            loss_sum += losses.detach()
+            correct += self.count_correct(pred, y)
+            batches += 1
+            total += idx.size(1)
+            if stopping.step():
+                break
+        # one transfer for all models, average loss over batches + accuracy as a percentage
+        return (loss_sum / batches).tolist(), (100 * correct / total).tolist()
+
+    def test(self):
+        n_models, n = len(self.models), len(self.X_test)
+        self.base.eval()
+        loss_sum = torch.zeros(n_models, device=self.device)
+        correct = torch.zeros(n_models, device=self.device)
+        batches = 0
+        with torch.no_grad():
+            for start in range(0, n, self.batch_size):
+                X = self.X_test[start : start + self.batch_size]
+                y = self.y_test[start : start + self.batch_size]
+                losses, pred = self.run_batch(X, y, (None, None))  # same test rows for every model
+                loss_sum += losses
+                correct += self.count_correct(pred, y)
+                batches += 1
+        return (loss_sum / batches).tolist(), (100 * correct / n).tolist()
+
+    def train_test_log(self, n_epochs, callbacks, stopping=None):
+        """
+        Same as Train.train_test_log, for every model at once.
+
+        :param n_epochs: Number of epochs.
+        :param callbacks: One callback (or None) per model, gets that model's epoch metrics.
+        :param stopping: StoppingPolicy for the whole group (budgets only).
+        :return: One RESULTS dict per model.
+        """
+        n_models = len(self.models)
+        stopping = stopping or StoppingPolicy()
+        n_epochs = stopping.start(n_epochs)
+        history = [
+            {"train_losses": [], "train_accs": [], "test_losses": [], "test_accs": []}
+            for _ in range(n_models)
+        ]
+        eval_epochs = []
+        for t in range(n_epochs):
+            epoch_start = time.perf_counter()
+            train_losses, train_accs = self.train(stopping)
+            samples_per_sec = len(self.X_train) * n_models / (time.perf_counter() - epoch_start)
+            test_losses, test_accs = [None] * n_models, [None] * n_models
+            if (t + 1) % self.eval_every == 0 or t + 1 == n_epochs or stopping.reason is not None:
+                test_losses, test_accs = self.test()
+                eval_epochs.append(t + 1)
+            print(f"Epoch {t + 1}/{n_epochs}: {n_models} models, {samples_per_sec:.0f} samples/s")
+
+            for i in range(n_models):
+                h = history[i]
+                h["train_losses"].append(train_losses[i])
+                h["train_accs"].append(train_accs[i])
+                if test_losses[i] is not None:
+                    h["test_losses"].append(test_losses[i])
+                    h["test_accs"].append(test_accs[i])
+                if callbacks[i] is not None:
+                    callbacks[i](
+                        {
+                            "event": "epoch",
+                            "epoch": t + 1,
+                            "samples_per_sec": samples_per_sec / n_models,
+                            "train_loss": train_losses[i],
+                            "train_acc": train_accs[i],
+                            "test_loss": test_losses[i],
+                            "test_acc": test_accs[i],
+                        }
+                    )
+            if stopping.epoch_end(t + 1, {}):
+                break
+
+        # trained weights back into the individual models (for the weight store)
+        for i, model in enumerate(self.models):
+            model.load_state_dict(
+                {name: value[i] for name, value in {**self.params, **self.buffers}.items()}
+            )
+
+        results = []
+        for h in history:
+            results.append(
+                {
+                    "train_losses": h["train_losses"],
+                    "test_losses": h["test_losses"],
+                    "avg_train_loss": sum(h["train_losses"]) / len(h["train_losses"]),
+                    "avg_test_loss": sum(h["test_losses"]) / len(h["test_losses"]),
+                    "avg_train_acc": sum(h["train_accs"]) / len(h["train_accs"]),
+                    "avg_test_acc": sum(h["test_accs"]) / len(h["test_accs"]),
+                    "eval_epochs": list(eval_epochs),
+                    "eval_policy": self.eval_policy,
+                    **stopping.summary(epochs_run=len(h["train_losses"])),
+                    "batched": {"group_size": n_models},
+                }
+            )
+        return results
+
+
+def run_train_batch(datas, callbacks):
+    """
+    run_train for a group of requests with the same batch_key().
+
+    :param datas: The requests.
+    :param callbacks: One callback (or None) per request.
+    :return: One RESULTS per request, in the same order.
+    """
+    first = datas[0]
+    with seeded(first):  # never seeded (not batchable), but seeded runs must not run next to it
+        models = [DynamicModel(data["layers"]) for data in datas]
+        epochs_before = [warm_start("train", data, model) for data, model in zip(datas, models)]
+        t = BatchedTrain(
+            models,
+            first["input"],
+            first["loss"],
+            first["optimizer"],
+            first["batch_size"],
+            eval_every=first.get("eval_every", 1),
+            eval_subsample=first.get("eval_subsample"),
+        )
+        print(f"slay... {len(models)} models initialized successfully!")
+        results = t.train_test_log(first["epoch"], callbacks, StoppingPolicy.from_request(None))
+    return [
+        finish("train", data, data["job_id"], model, result, before)
+        for data, model, result, before in zip(datas, models, results, epochs_before)
+    ]
+
+
+# kind --> (group key, runner for a whole group), used by the job queue for "batch": true
+BATCH_RUNNERS = {"train": (batch_key, run_train_batch)}
@@ -0,0 +1,49 @@
+import sys
+import time
+
+from batched import BATCH_RUNNERS
+from jobs import JobQueue
+from runners import RUNNERS
+
+# n concurrent /train jobs with the same pima MLP: one Train loop per job vs
+# "batch": true (all jobs in one vmapped loop)
+#   python bench_batched.py [epochs]
+
+epochs = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+data = {
+    "input": "pima",
+    "layers": [
+        {"kind": "Linear", "args": (8, 12)},
+        {"kind": "ReLU"},
+        {"kind": "Linear", "args": (12, 8)},
+        {"kind": "ReLU"},
+        {"kind": "Linear", "args": (8, 1)},
+        {"kind": "Sigmoid"},
+    ],
+    "loss": "BCE",
+    "optimizer": {"kind": "Adam", "lr": 0.001},
+    "epoch": epochs,
+    "batch_size": 10,
+}
+
+
+def run_jobs(jobs, n, batch):
+    start = time.perf_counter()
+    submitted = [jobs.submit("train", dict(data, batch=batch)) for _ in range(n)]
+    while any(job.status in ("queued", "running") for job in submitted):
+        time.sleep(0.01)
+    failed = [job.error for job in submitted if job.status == "failed"]
+    if failed:
+        raise RuntimeError(failed[0])
+    return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    jobs = JobQueue(RUNNERS, max_workers=2, max_queued=64, batch_runners=BATCH_RUNNERS, batch_window=0.1)
+    run_jobs(jobs, 1, False)  # warm up (dataset load)
+
+    print(f"epochs={epochs} (times include the {jobs.batch_window}s batching window)")
+    for n in (1, 32):
+        for batch in (False, True):
+            seconds = run_jobs(jobs, n, batch)
+            print(f"batch={batch!s:<5} {n:>3} jobs  {seconds:7.2f}s  {n / seconds:6.2f} jobs/s")
@@ -0,0 +1,40 @@
+import sys
+import time
+
+from executor import available_cores
+from runners import run_transformer_train
+
+# data-parallel scaling of /transformertrain on CPU: same request (same global batch) on
+# 1 / 2 / 4 / 8 processes, each process gets cores // processes torch threads
+#   python bench_ddp.py [stride] [epochs]
+
+stride = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+epochs = int(sys.argv[2]) if len(sys.argv) > 2 else 1
+data = {
+    "input": "alice",
+    "layers": [
+        {"kind": "Decoder", "args": (100, 4, 512)},
+        {"kind": "Decoder", "args": (100, 4, 512)},
+        {"kind": "Output", "args": 0.3},
+    ],
+    "loss": "CrossEntropy",
+    "optimizer": {"kind": "Adam", "lr": 0.001},
+    "epoch": epochs,
+    "batch_size": 64,
+    "stride": stride,
+}
+
+
+if __name__ == "__main__":
+    print(f"cores={available_cores()} stride={stride} epochs={epochs}")
+    baseline = None
+    for processes in (1, 2, 4, 8):
+        start = time.perf_counter()
+        results = run_transformer_train(dict(data, processes=processes))
+        seconds = time.perf_counter() - start  # includes process start up, a real request pays it too
+        tokens_per_sec = results["tokens_per_epoch"] * results["epochs_run"] / seconds
+        baseline = baseline or tokens_per_sec
+        print(
+            f"{processes} processes  {seconds:7.2f}s  {tokens_per_sec:9.0f} tokens/s  "
+            f"x{tokens_per_sec / baseline:.2f}  final loss {results['train_loss'][-1]:.3f}"
+        )
@@ -0,0 +1,58 @@
+import sys
+import time
+
+from executor import ProcessExecutor, available_cores
+from jobs import JobQueue
+from runners import RUNNERS
+
+# aggregate throughput of concurrent /train jobs (pima MLP) with the thread backend
+# (every job in this process, fighting over the GIL + torch's thread pool) vs the process backend
+#   python bench_executor.py [epochs]
+
+epochs = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+data = {
+    "input": "pima",
+    "layers": [
+        {"kind": "Linear", "args": (8, 12)},
+        {"kind": "ReLU"},
+        {"kind": "Linear", "args": (12, 8)},
+        {"kind": "ReLU"},
+        {"kind": "Linear", "args": (8, 1)},
+        {"kind": "Sigmoid"},
+    ],
+    "loss": "BCE",
+    "optimizer": {"kind": "Adam", "lr": 0.001},
+    "epoch": epochs,
+    "batch_size": 10,
+}
+
+
+def run_jobs(jobs, n):
+    start = time.perf_counter()
+    submitted = [jobs.submit("train", data) for _ in range(n)]
+    while any(job.status in ("queued", "running") for job in submitted):
+        time.sleep(0.05)
+    failed = [job.error for job in submitted if job.status == "failed"]
+    if failed:
+        raise RuntimeError(failed[0])
+    return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    cores = available_cores()
+    executor = ProcessExecutor()
+    backends = {
+        "thread": JobQueue(RUNNERS, max_workers=cores, max_queued=64),
+        "process": JobQueue(
+            executor.runners(RUNNERS), max_workers=executor.max_workers, max_queued=64
+        ),
+    }
+    for jobs in backends.values():
+        run_jobs(jobs, 1)  # warm up (dataset load, worker start)
+
+    print(f"cores={cores} epochs={epochs} process workers={executor.max_workers} x {executor.threads_per_worker} threads")
+    for n in (1, 4, 16):
+        for name, jobs in backends.items():
+            seconds = run_jobs(jobs, n)
+            print(f"{name:<8} {n:>3} jobs  {seconds:7.2f}s  {n / seconds:6.2f} jobs/s")
+    executor.shutdown()
@@ -0,0 +1,76 @@
+import time
+
+import torch
+
+from models import TransformerModel, TRANSFORMER_DATA
+
+# per-step forward time for the /transformertrain default config (see app.transformertrain),
+# before (fresh float mask built on the CPU every call) vs after (memoized mask + causal
+# hints for the legacy layers, is_causal SDPA for the Decoder blocks)
+#   python bench_transformer.py
+
+embed_dim = 100
+heads = 2
+hidden_dim = 2048
+batch_size = 32
+steps = 20
+
+
+def forward_before(model, x):
+    # TransformerModel.forward as it was: mask rebuilt + copied to the device on every call
+    emb = model.emb(x)
+    sz = x.size(1)
+    mask = (torch.triu(torch.ones(sz, sz)) == 1).transpose(0, 1)
+    mask = (
+        mask.float()
+        .masked_fill(mask == 0, float("-inf"))
+        .masked_fill(mask == 1, float(0.0))
+    ).to(x.device)
+    x = model.pos_encoder(emb)
+    for decoder in model.decoder_layers:
+        x = decoder(x, memory=x, tgt_mask=mask, memory_mask=mask)
+    return model.linear_layer(model.dropout_layer(x))
+
+
+def time_forward(forward, model, x):
+    model.train()
+    for _ in range(3):  # warm up
+        forward(model, x)
+    if x.device.type == "cuda":
+        torch.cuda.synchronize()
+    start = time.perf_counter()
+    for _ in range(steps):
+        forward(model, x)
+    if x.device.type == "cuda":
+        torch.cuda.synchronize()
+    return (time.perf_counter() - start) / steps
+
+
+if __name__ == "__main__":
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    dataset = TRANSFORMER_DATA["alice"]
+    x = torch.randint(
+        0, dataset.vocab_size, (batch_size, dataset.sequence_length), device=device
+    )
+
+    def build(kind):
+        torch.manual_seed(0)
+        layers = [
+            {"kind": kind, "args": (embed_dim, heads, hidden_dim)},
+            {"kind": kind, "args": (embed_dim, heads, hidden_dim)},
+            {"kind": "Output", "args": 0.3},
+        ]
+        return TransformerModel(layers, dataset.vocab_size, dataset.sequence_length).to(device)
+
+    legacy = build("LegacyDecoder")
+    decoder = build("Decoder")
+    results = {
+        "before (LegacyDecoder, mask per call)": time_forward(forward_before, legacy, x),
+        "after (LegacyDecoder, cached mask)": time_forward(lambda m, x: m(x), legacy, x),
+        "after (Decoder, fused causal SDPA)": time_forward(lambda m, x: m(x), decoder, x),
+    }
+
+    print(f"device={device} batch={batch_size} seq={dataset.sequence_length} steps={steps}")
+    baseline = results["before (LegacyDecoder, mask per call)"]
+    for name, seconds in results.items():
+        print(f"{name:<40} {seconds * 1000:8.2f} ms/step  ({baseline / seconds:.2f}x)")
@@ -0,0 +1,157 @@
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+
+class KVCache:
+    """
+    Keys/values of every decoder layer in a model, for incremental decoding.
+
+    :param n_layers: Number of decoder blocks.
+    """
+
+    def __init__(self, n_layers):
+        # per layer {"k", "v"} (Decoder) or {"self": {"k", "v"}, "cross": {"k", "v"}} (LegacyDecoder)
+        self.layers = [{} for _ in range(n_layers)]
+        self.length = 0  # number of positions already cached
+
+
+def attend(q, k, v, kv=None, dropout_p=0.0):
+    """
+    Causal scaled dot-product attention over [batch, heads, length, head_dim]
+    tensors. With a KVCache slot, k/v are appended to the cached ones first and
+    q only holds the new positions.
+
+    :param kv: {"k", "v"} of one attention layer in a KVCache, or None.
+    """
+    length = q.size(2)
+    if kv is not None:  # incremental decoding --> q/k/v only hold the new positions
+        if kv:
+            k = torch.cat([kv["k"], k], dim=2)
+            v = torch.cat([kv["v"], v], dim=2)
+        kv["k"], kv["v"] = k, v
+
+    mask, is_causal = None, True
+    if length != k.size(2):  # new positions see everything cached + the new ones before them
+        is_causal = False
+        if length > 1:
+            mask = torch.ones(length, k.size(2), dtype=torch.bool, device=q.device).tril(
+                diagonal=k.size(2) - length
+            )
+    return F.scaled_dot_product_attention(
+        q, k, v, attn_mask=mask, dropout_p=dropout_p, is_causal=is_causal
+    )
+
+
+def _split_heads(x, heads):
+    # [batch, length, embed_dim] --> [batch, heads, length, head_dim]
+    batch, length, embed_dim = x.shape
+    return x.view(batch, length, heads, embed_dim // heads).transpose(1, 2)
+
+
+def _cached_mha(attn, query, source, kv):
+    # nn.MultiheadAttention(query, source, source) with a causal mask, keys/values of source cached
+    w_q, w_k, w_v = attn.in_proj_weight.chunk(3)
+    b_q, b_k, b_v = attn.in_proj_bias.chunk(3)
+    q = _split_heads(F.linear(query, w_q, b_q), attn.num_heads)
+    k = _split_heads(F.linear(source, w_k, b_k), attn.num_heads)
+    v = _split_heads(F.linear(source, w_v, b_v), attn.num_heads)
+    out = attend(q, k, v, kv)
+    return attn.out_proj(out.transpose(1, 2).reshape(query.shape))
+
+
+def legacy_decoder_step(layer, x, kv):
+    """
+    Incremental decoding for a "LegacyDecoder" (batch_first, post-norm
+    nn.TransformerDecoderLayer) run the way TransformerModel runs it: memory is
+    the layer input, with a causal memory mask. So the cross-attention keys and
+    values come from the same positions as the self-attention ones and are
+    cached the same way. Eval only (no dropout in the attention).
+
+    :param layer: The nn.TransformerDecoderLayer.
+    :param x: [batch, new positions, embed_dim]
+    :param kv: This layer's slot of a KVCache.
+    """
+    memory = x
+    x = layer.norm1(x + layer.dropout1(_cached_mha(layer.self_attn, x, x, kv.setdefault("self", {}))))
+    x = layer.norm2(
+        x + layer.dropout2(_cached_mha(layer.multihead_attn, x, memory, kv.setdefault("cross", {})))
+    )
+    x = layer.norm3(
+        x + layer.dropout3(layer.linear2(layer.dropout(layer.activation(layer.linear1(x)))))
+    )
+    return x
+
+
+class CausalDecoderBlock(nn.Module):
+    """
+    Decoder-only transformer block: causal self-attention + feed-forward, no
+    cross-attention. Same post-norm layout, relu and dropout as
+    nn.TransformerDecoderLayer, so state dicts saved from the legacy layer load
+    into it (everything except the cross-attention weights).
+
+    :param embed_dim: Embedding dimension.
+    :param heads: Number of attention heads (must divide embed_dim).
+    :param hidden_dim: Feed-forward hidden size.
+    :param dropout: Dropout value (default=0.1)
+    """
+
+    def __init__(self, embed_dim, heads, hidden_dim, dropout=0.1):
+        super().__init__()
+        if embed_dim % heads != 0:
+            raise ValueError(f"embed_dim {embed_dim} is not divisible by heads {heads}")
+        self.heads = heads
+        self.dropout = dropout
+
+        self.in_proj = nn.Linear(embed_dim, 3 * embed_dim)  # q, k, v in one matmul
+        self.out_proj = nn.Linear(embed_dim, embed_dim)
+        self.linear1 = nn.Linear(embed_dim, hidden_dim)
+        self.linear2 = nn.Linear(hidden_dim, embed_dim)
+        self.norm1 = nn.LayerNorm(embed_dim)
+        self.norm2 = nn.LayerNorm(embed_dim)
+        self.dropout1 = nn.Dropout(dropout)
+        self.dropout2 = nn.Dropout(dropout)
+        self.dropout_ff = nn.Dropout(dropout)
+
+    def attention(self, x, kv=None):
+        batch, length, embed_dim = x.shape
+        # [batch, length, 3 * embed_dim] --> 3 x [batch, heads, length, head_dim]
+        q, k, v = (
+            self.in_proj(x)
+            .view(batch, length, 3, self.heads, embed_dim // self.heads)
+            .permute(2, 0, 3, 1, 4)
+        )
+        out = attend(q, k, v, kv, dropout_p=self.dropout if self.training else 0.0)
+        out = out.transpose(1, 2).reshape(batch, length, embed_dim)
+        return self.out_proj(out)
+
+    def forward(self, x, kv=None):
+        """
+        :param x: [batch, length, embed_dim]
+        :param kv: This block's slot of a KVCache, or None to run without caching.
+        """
+        x = self.norm1(x + self.dropout1(self.attention(x, kv)))
+        x = self.norm2(
+            x + self.dropout2(self.linear2(self.dropout_ff(F.relu(self.linear1(x)))))
+        )
+        return x
+
+    def _load_from_state_dict(self, state_dict, prefix, *args, **kwargs):
+        # map nn.TransformerDecoderLayer keys onto this block, dropping the cross-attention
+        if prefix + "self_attn.in_proj_weight" in state_dict:
+            for key in [k for k in state_dict if k.startswith(prefix)]:
+                name = key[len(prefix) :]
+                if name.startswith(("multihead_attn.", "norm2.")):
+                    del state_dict[key]
+            renames = {
+                "self_attn.in_proj_weight": "in_proj.weight",
+                "self_attn.in_proj_bias": "in_proj.bias",
+                "self_attn.out_proj.weight": "out_proj.weight",
+                "self_attn.out_proj.bias": "out_proj.bias",
+                "norm3.weight": "norm2.weight",
+                "norm3.bias": "norm2.bias",
+            }
+            for old, new in renames.items():
+                if prefix + old in state_dict:
+                    state_dict[prefix + new] = state_dict.pop(prefix + old)
+        super()._load_from_state_dict(state_dict, prefix, *args, **kwargs)
@@ -0,0 +1,193 @@
+import json
+import os
+import queue
+import random
+import threading
+import time
+
+import numpy as np
+import torch
+
+from files import write_atomic
+
+# one folder per job: spec.json (what to re-run) + checkpoint.pt (latest state only)
+CHECKPOINT_DIR = "data/checkpoints"
+
+# request keys that only make sense for the original request, not for a resumed one
+_NOT_RESUMABLE = ("job_id", "resume", "stream", "async", "emit_every")
+
+
+def rng_state():
+    state = {
+        "torch": torch.get_rng_state(),
+        "python": random.getstate(),  # StridedSampler + the streaming shuffle buffer use this
+        "numpy": np.random.get_state(),
+    }
+    if torch.cuda.is_available():
+        state["cuda"] = torch.cuda.get_rng_state_all()
+    return state
+
+
+def set_rng_state(state):
+    torch.set_rng_state(state["torch"])
+    random.setstate(state["python"])
+    np.random.set_state(state["numpy"])
+    if "cuda" in state and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state["cuda"])
+
+
+def _snapshot(obj):
+    # copy every tensor to the host now, so the optimizer can keep updating the originals
+    # while the copy is written in the background
+    if isinstance(obj, torch.Tensor):
+        return obj.detach().to("cpu", copy=True)
+    if isinstance(obj, dict):
+        return {k: _snapshot(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(_snapshot(v) for v in obj)
+    return obj
+
+
+def load_spec(run_id, directory=CHECKPOINT_DIR):
+    # {"kind": ..., "data": ...} of the request that made the checkpoint, None if there's none
+    path = os.path.join(directory, run_id, "spec.json")
+    if not os.path.exists(path):
+        return None
+    with open(path, "r") as file:
+        return json.load(file)
+
+
+class Checkpointer:
+    """
+    Saves model, optimizer, RNG and loop state every `every_steps` optimizer
+    steps and/or every `every_seconds` seconds. The tensors are copied to the
+    host on the training thread, the file is written on a background thread
+    (atomically, so a crash mid-write keeps the previous checkpoint).
+
+    :param run_id: Job id, names the checkpoint folder.
+    :param spec: {"kind": ..., "data": ...} needed to re-run the job after a restart.
+    :param every_steps: Checkpoint every N optimizer steps.
+    :param every_seconds: Checkpoint every N seconds.
+    """
+
+    def __init__(self, run_id, spec, every_steps=None, every_seconds=None, directory=CHECKPOINT_DIR):
+        if every_steps is None and every_seconds is None:
+            every_seconds = 60  # default when the request just says "checkpoint": true
+        self.run_id = run_id
+        self.every_steps = every_steps
+        self.every_seconds = every_seconds
+        self.dir = os.path.join(directory, run_id)
+        self.path = os.path.join(self.dir, "checkpoint.pt")
+        self.saves = 0
+        self.write_seconds = 0.0  # time spent by the writer thread, not by the loop
+        self._steps = 0
+        self._last_save = time.perf_counter()
+
+        os.makedirs(self.dir, exist_ok=True)
+        spec_path = os.path.join(self.dir, "spec.json")
+        write_atomic(spec_path, lambda f: f.write(json.dumps(spec).encode("utf-8")))
+
+        self._pending = queue.Queue()
+        self._closed = False
+        self._writer = threading.Thread(target=self._write_loop, daemon=True)
+        self._writer.start()
+
+    @classmethod
+    def from_request(cls, kind, data, run_id):
+        """
+        Checkpointer for a request with "checkpoint": {"every_steps": ..., "every_seconds": ...}
+        (or just true), None if the request doesn't want checkpoints.
+        """
+        options = data.get("checkpoint")
+        if not options:
+            return None
+        if options is True:
+            options = {}
+        spec = {
+            "kind": kind,
+            "data": {k: v for k, v in data.items() if k not in _NOT_RESUMABLE},
+        }
+        return cls(run_id, spec, **options)
+
+    def load(self):
+        # latest checkpoint of this run, None if nothing was saved yet
+        if not os.path.exists(self.path):
+            return None
+        return torch.load(self.path, map_location="cpu", weights_only=False)  # our own file
+
+    def step(self, make_state):
+        """
+        Call after every optimizer step. make_state() builds the state to save and
+        is only called when a checkpoint is due.
+        """
+        self._steps += 1
+        due = (self.every_steps and self._steps >= self.every_steps) or (
+            self.every_seconds and time.perf_counter() - self._last_save >= self.every_seconds
+        )
+        if due:
+            self.save(make_state())
+
+    def save(self, state):
+        self._steps = 0
+        self._last_save = time.perf_counter()
+        self._pending.put(_snapshot(state))
+
+    def close(self, final_state=None):
+        # wait for the writes still in flight (and write the final state, if any). only the first
+        # call counts, so a finished loop can close with its final state and the runner again after
+        if self._closed:
+            return
+        self._closed = True
+        if final_state is not None:
+            self.save(dict(final_state, finished=True))
+        self._pending.put(None)
+        self._writer.join()
+
+    def info(self):
+        # for RESULTS
+        return {
+            "job_id": self.run_id,
+            "path": self.path,
+            "saves": self.saves,
+            "write_seconds": self.write_seconds,
+        }
+
+    def _write_loop(self):
+        while True:
+            state = self._pending.get()
+            closing = state is None
+            while not closing and not self._pending.empty():
+                # writing a state that's already outdated is wasted work, skip to the newest
+                newer = self._pending.get()
+                if newer is None:
+                    closing = True
+                else:
+                    state = newer
+            if state is not None:
+                start = time.perf_counter()
+                write_atomic(self.path, lambda f: torch.save(state, f))
+                self.saves += 1
+                self.write_seconds += time.perf_counter() - start
+            if closing:
+                return
+
+
+def resume_batches(loader, resume=None):
+    """
+    enumerate(loader) for one epoch. When resuming in the middle of an epoch,
+    the loader is replayed with the RNG state from the start of that epoch (same
+    shuffle order) and the batches that were already trained on are skipped.
+
+    :param loader: DataLoader (or anything iterable) of the epoch.
+    :param resume: Checkpoint taken in this epoch, None for a normal epoch.
+    """
+    skip = 0
+    if resume is not None:
+        skip = resume["batch"]
+        set_rng_state(resume["epoch_rng"])
+    for batch, item in enumerate(loader):
+        if batch < skip:
+            if batch + 1 == skip:  # dropout etc. continue exactly where the checkpoint left off
+                set_rng_state(resume["rng"])
+            continue
+        yield batch, item
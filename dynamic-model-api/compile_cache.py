@@ -0,0 +1,155 @@
+import copy
+import json
+import threading
+import time
+
+import torch
+import torch.nn as nn
+from torch.func import functional_call
+
+# "compile": true on /train --> the model's forward runs through torch.compile. The compiled
+# function takes the weights as inputs, so it is shared by every model with the same layers
+# and input shape in this process, and only the first request with that architecture compiles
+
+
+def default_device():
+    # same choice as Train
+    if torch.cuda.is_available():
+        return "cuda"
+    if torch.backends.mps.is_available():
+        return "mps"
+    return "cpu"
+
+
+def _compile(model, training):
+    # structure-only copy in a fixed train/eval mode, so concurrent jobs never flip a shared flag
+    base = copy.deepcopy(model).to("meta").train(training)
+
+    def forward(params, buffers, x):
+        return functional_call(base, (params, buffers), (x,))
+
+    return torch.compile(forward)
+
+
+class CompiledModel(nn.Module):
+    """
+    Runs `model` through the compiled functions of its cache entry. Parameters,
+    state_dict and load_state_dict are the wrapped model's own, so checkpoints
+    and stored weights look the same as without compiling.
+
+    :param model: The DynamicModel.
+    :param entry: CompileCache entry for its layers + input shape.
+    """
+
+    def __init__(self, model, entry):
+        super().__init__()
+        self.model = model
+        self.entry = entry
+
+    def forward(self, x):
+        compiled = self.entry["train"] if self.training else self.entry["eval"]
+        return compiled(dict(self.model.named_parameters()), dict(self.model.named_buffers()), x)
+
+    def state_dict(self, *args, **kwargs):
+        return self.model.state_dict(*args, **kwargs)
+
+    def load_state_dict(self, state_dict, strict=True, assign=False):
+        return self.model.load_state_dict(state_dict, strict, assign)
+
+
+class CompileCache:
+    """
+    Process-wide cache of compiled forwards, keyed by layer spec + input shape +
+    device. A new entry is compiled and warmed up right away, which is also when
+    compile time and the steady-state speedup over eager mode are measured.
+
+    :param max_entries: Architectures kept (oldest dropped first).
+    :param bench_steps: Training steps timed per mode for the speedup.
+    """
+
+    def __init__(self, max_entries=32, bench_steps=20):
+        self.max_entries = max_entries
+        self.bench_steps = bench_steps
+        self.entries = {}  # key -> {"train", "eval", "compile_seconds", "speedup", "hits"}
+        self._locks = {}  # key -> lock, so one architecture is only compiled once at a time
+        self._lock = threading.Lock()
+
+    def wrap(self, model, layers, input_shape, batch_size):
+        """
+        (CompiledModel, info for RESULTS) for a freshly built DynamicModel.
+
+        :param model: The DynamicModel, moved to default_device().
+        :param layers: Its layer spec.
+        :param input_shape: Shape of one sample (params.INPUT_SHAPES).
+        :param batch_size: Batch size used for the warm up.
+        """
+        device = default_device()
+        model.to(device)
+        key = json.dumps({"layers": layers, "input_shape": list(input_shape), "device": device}, sort_keys=True)
+        with self._lock:
+            lock = self._locks.setdefault(key, threading.Lock())
+        with lock:
+            entry = self.entries.get(key)
+            cache_hit = entry is not None
+            if cache_hit:
+                entry["hits"] += 1
+            else:
+                try:
+                    entry = self._build(model, torch.zeros((batch_size, *input_shape), device=device))
+                except Exception:
+                    with self._lock:
+                        self._locks.pop(key, None)
+                    raise
+                with self._lock:
+                    self.entries[key] = entry
+                    while len(self.entries) > self.max_entries:
+                        oldest = next(iter(self.entries))
+                        del self.entries[oldest]
+                        self._locks.pop(oldest, None)  # the lock goes with its entry
+        return CompiledModel(model, entry), {
+            "cache_hit": cache_hit,
+            "compile_seconds": 0.0 if cache_hit else entry["compile_seconds"],
+            "first_compile_seconds": entry["compile_seconds"],
+            "steady_state_speedup": entry["speedup"],
+        }
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self.entries),
+                "hits": sum(e["hits"] for e in self.entries.values()),
+            }
+
+    def _build(self, model, x):
+        entry = {"train": _compile(model, True), "eval": _compile(model, False), "hits": 0}
+        compiled = CompiledModel(model, entry)
+        # dropout in the warm up draws from a forked copy of torch's RNG, so neither this run's
+        # stream nor anyone else's moves
+        with torch.random.fork_rng():
+            start = time.perf_counter()
+            self._step(compiled, x)  # the first call is the one that compiles
+            with torch.no_grad():
+                compiled.eval()(x)
+            compiled.train()
+            entry["compile_seconds"] = time.perf_counter() - start
+            eager = self._time(model, x)
+            entry["speedup"] = eager / self._time(compiled, x)
+        model.zero_grad(set_to_none=True)  # the warm up must not leak into the first real step
+        return entry
+
+    def _step(self, model, x):
+        model(x).float().sum().backward()
+
+    def _time(self, model, x):
+        self._step(model, x)
+        if x.device.type == "cuda":
+            torch.cuda.synchronize()
+        start = time.perf_counter()
+        for _ in range(self.bench_steps):
+            self._step(model, x)
+        if x.device.type == "cuda":
+            torch.cuda.synchronize()
+        return (time.perf_counter() - start) / self.bench_steps
+
+
+COMPILE_CACHE = CompileCache()
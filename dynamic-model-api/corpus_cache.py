@@ -0,0 +1,67 @@
+import glob
+import hashlib
+import json
+import os
+
+import numpy as np
+import torch
+
+from files import write_atomic
+
+# tokenized corpora, one .ids.npy (memory mapped) + .vocab.json per text file version
+CACHE_DIR = "data/corpus_cache"
+# bump this whenever encode() changes so old cache entries stop matching
+TOKENIZER = "whitespace-v1"
+
+
+def cache_key(file_path):
+    """Hash of the text file's contents plus the tokenization settings."""
+    h = hashlib.sha256()
+    h.update(f"{TOKENIZER}|int64|".encode())
+    with open(file_path, "rb") as file:
+        for chunk in iter(lambda: file.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()[:16]
+
+
+def encode(text):
+    """Split on whitespace and map words to ids in order of first appearance."""
+    word_to_int = {}
+    ids = np.fromiter(
+        (word_to_int.setdefault(word, len(word_to_int)) for word in text.split()),
+        dtype=np.int64,
+    )
+    return list(word_to_int), ids
+
+
+def load_corpus(file_path):
+    """
+    Load (vocab, ids) for a text file, tokenizing it only if there's no cache
+    entry for its current contents. ids is a tensor backed by a copy-on-write
+    memory map, so every worker reading the same corpus shares the same pages.
+
+    :param file_path: Path to the text file.
+    """
+    name = os.path.splitext(os.path.basename(file_path))[0]
+    prefix = os.path.join(CACHE_DIR, f"{name}-{cache_key(file_path)}")
+    ids_path, vocab_path = prefix + ".ids.npy", prefix + ".vocab.json"
+
+    if not (os.path.exists(ids_path) and os.path.exists(vocab_path)):
+        with open(file_path, "r", encoding="utf-8") as file:
+            vocab, ids = encode(file.read())
+
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        for stale in glob.glob(os.path.join(CACHE_DIR, f"{name}-*")):
+            if not stale.startswith(prefix):  # entries for older versions of this file
+                try:
+                    os.remove(stale)
+                except FileNotFoundError:  # another worker got to it first
+                    pass
+        write_atomic(vocab_path, lambda f: f.write(json.dumps(vocab).encode("utf-8")))
+        write_atomic(ids_path, lambda f: np.save(f, ids))  # written last --> marks the entry complete
+        print(f"Cached tokenized {file_path} to {prefix}")
+
+    with open(vocab_path, "r", encoding="utf-8") as file:
+        vocab = json.load(file)
+    ids = np.load(ids_path, mmap_mode="c")
+    return vocab, torch.from_numpy(ids)
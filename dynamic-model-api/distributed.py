@@ -0,0 +1,215 @@
+import io
+import math
+import os
+import queue
+import socket
+import time
+
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+from torch.nn.parallel import DistributedDataParallel
+from torch.utils.data import DataLoader
+
+from executor import available_cores
+from metrics import MetricsAccumulator
+from models import StridedSampler, TransformerData, TransformerModel, TRANSFORMER_DATA
+from params import LOSSES, OPTIMIZERS
+from stopping import StoppingPolicy
+
+# /transformertrain with "processes": n --> n local processes, each training on its own shard
+# of the windows, with gradients all-reduced over gloo after every backward pass
+
+
+class DistributedStridedSampler(StridedSampler):
+    """
+    StridedSampler split across processes. Every rank draws the same phase and
+    order (seeded by the epoch) and keeps every world_size-th window, padded so
+    that all ranks run the same number of batches.
+
+    :param n: Number of windows in the dataset.
+    :param stride: Distance in words between consecutive windows.
+    :param rank: This process's rank.
+    :param world_size: Number of processes.
+    :param seed: Shared seed, ranks only agree on the order if it's the same everywhere.
+    """
+
+    def __init__(self, n, stride, rank, world_size, seed=0):
+        super().__init__(n, stride)
+        self.rank = rank
+        self.world_size = world_size
+        self.seed = seed
+        self.epoch = 0
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def __len__(self):
+        return math.ceil(self.count / self.world_size)
+
+    def __iter__(self):
+        self.generator = torch.Generator().manual_seed(self.seed + self.epoch)
+        offsets = list(super().__iter__())
+        total = len(self) * self.world_size
+        offsets = (offsets * math.ceil(total / max(len(offsets), 1)))[:total]  # pad by repeating
+        return iter(offsets[self.rank :: self.world_size])
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _worker(rank, world_size, port, data, initial_state, threads, events):
+    os.environ["MASTER_ADDR"] = "127.0.0.1"
+    os.environ["MASTER_PORT"] = str(port)
+    torch.set_num_threads(threads)  # all processes together use the machine's cores, no more
+    torch.set_num_interop_threads(1)
+    dist.init_process_group("gloo", rank=rank, world_size=world_size)
+    try:
+        result = _train(rank, world_size, data, initial_state, events)
+        if rank == 0:
+            buffer = io.BytesIO()  # plain bytes, so the queue doesn't depend on this process staying alive
+            torch.save(result.pop("model"), buffer)
+            events.put(("result", result, buffer.getvalue()))
+    finally:
+        dist.destroy_process_group()
+
+
+def _train(rank, world_size, data, initial_state, events):
+    seed = data.get("seed", 0)
+    torch.manual_seed(seed + rank)  # different dropout masks on every rank
+    log_every = data.get("log_every", 0)
+    # batch_size is the global batch, so the same request means the same optimization on any number of processes
+    batch_size = max(data["batch_size"] // world_size, 1)
+
+    dataset = TRANSFORMER_DATA[data["input"]]
+    model = TransformerModel(data["layers"], dataset.vocab_size, dataset.sequence_length)
+    model.load_state_dict(initial_state)  # same start everywhere (incl. warm starts)
+    ddp_model = DistributedDataParallel(model)
+    loss_fn = LOSSES[data["loss"]]
+    optimizer = OPTIMIZERS[data["optimizer"]["kind"]](model.parameters(), data["optimizer"]["lr"])
+
+    sampler = DistributedStridedSampler(len(dataset), data.get("stride", 1), rank, world_size, seed)
+    loader = DataLoader(
+        dataset, batch_size=batch_size, sampler=sampler, collate_fn=TransformerData.collate
+    )
+
+    stopping = StoppingPolicy.from_request(data.get("stopping"))
+    n_epochs = stopping.start(data["epoch"])
+    ddp_model.train()
+    train_loss = []
+    tokens = 0
+
+    for epoch in range(n_epochs):
+        sampler.set_epoch(epoch)
+        metrics = MetricsAccumulator("cpu")
+        epoch_start = time.perf_counter()
+        epoch_samples = 0
+        for batch, (input_seq, target_seq) in enumerate(loader):
+            tokens += input_seq.numel()
+            epoch_samples += input_seq.size(0)
+            outputs = ddp_model(input_seq).view(-1, dataset.vocab_size)
+            loss = loss_fn(outputs, target_seq.reshape(-1))
+
+            optimizer.zero_grad()
+            loss.backward()  # DDP averages the gradients over all ranks here
+            optimizer.step()
+            metrics.update(loss)
+            if rank == 0 and log_every and (batch + 1) % log_every == 0:
+                events.put(
+                    {
+                        "event": "batch",
+                        "epoch": epoch + 1,
+                        "batch": batch + 1,
+                        "loss": metrics.read()["loss"],  # rank 0's shard only
+                        "samples_per_sec": epoch_samples * world_size
+                        / (time.perf_counter() - epoch_start),
+                    }
+                )
+            # every rank has to stop at the same step, or the others wait forever in the
+            # next all-reduce. max_steps agrees by construction, the clock doesn't
+            stop = torch.tensor(float(stopping.step()))
+            dist.all_reduce(stop, op=dist.ReduceOp.MAX)
+            if stop.item():
+                stopping.reason = stopping.reason or "max_seconds"
+                break
+
+        # mean loss over the batches of all ranks
+        local = metrics.read()
+        totals = torch.tensor([local["loss"] * local["batches"], local["batches"], epoch_samples])
+        dist.all_reduce(totals)
+        epoch_loss = (totals[0] / totals[1].clamp(min=1)).item()
+        epoch_samples = int(totals[2].item())
+        epoch_time = time.perf_counter() - epoch_start
+        train_loss.append(epoch_loss)
+        if rank == 0:
+            print(f"Epoch {epoch} loss: {epoch_loss:.3f}")
+            events.put(
+                {
+                    "event": "epoch",
+                    "epoch": epoch + 1,
+                    "train_loss": epoch_loss,
+                    "samples_per_sec": epoch_samples / epoch_time,
+                    "tokens_per_sec": epoch_samples * dataset.sequence_length / epoch_time,
+                }
+            )
+        if stopping.epoch_end(epoch + 1, {"train_loss": epoch_loss}):  # same loss on every rank
+            break
+
+    total_tokens = torch.tensor(float(tokens))
+    dist.all_reduce(total_tokens)
+    return {
+        "train_loss": train_loss,
+        "tokens_per_epoch": int(total_tokens.item()) // max(len(train_loss), 1),
+        **stopping.summary(epochs_run=len(train_loss)),
+        "model": model.state_dict(),
+    }
+
+
+def train_distributed(model, data, processes, callback=None):
+    """
+    Train a TransformerModel with DistributedDataParallel over `processes` local
+    processes (gloo backend, CPU). Returns the same RESULTS as
+    TransformerTrain.train and leaves the trained weights in model.
+
+    :param model: Initial model, its weights are broadcast to every process.
+    :param data: The /transformertrain request.
+    :param processes: Number of processes.
+    :param callback: Gets the epoch / batch metrics of rank 0, like TransformerTrain.train.
+    """
+    if data.get("streaming") or data.get("sampling", "stride") != "stride":
+        raise ValueError("processes > 1 only supports map-style data with stride sampling")
+    threads = max(available_cores() // processes, 1)
+    initial_state = {k: v.detach().cpu() for k, v in model.state_dict().items()}
+
+    ctx = mp.get_context("spawn")
+    events = ctx.Queue()
+    workers = mp.start_processes(
+        _worker,
+        args=(processes, _free_port(), data, initial_state, threads, events),
+        nprocs=processes,
+        join=False,
+        start_method="spawn",
+    )
+    result = None
+    finished = False
+    while True:
+        try:
+            event = events.get(timeout=0.1)
+        except queue.Empty:
+            if finished:  # everything the workers sent has been read
+                break
+            finished = workers.join(timeout=0)  # raises if a worker failed
+            continue
+        if isinstance(event, tuple):  # ("result", RESULTS, weights)
+            _, result, weights = event
+            model.load_state_dict(torch.load(io.BytesIO(weights), weights_only=True))
+        elif callback is not None:
+            callback(event)
+
+    if result is None:
+        raise RuntimeError("Distributed training finished without a result")
+    result["distributed"] = {"processes": processes, "threads_per_process": threads}
+    return result
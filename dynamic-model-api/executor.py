@@ -0,0 +1,131 @@
+import itertools
+import multiprocessing as mp
+import os
+import queue
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+# set in each worker process by _init_worker
+_events = None
+
+
+def available_cores():
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def _init_worker(slot, events, threads, pin_cpus):
+    global _events
+    _events = events
+
+    import torch
+
+    # every worker gets its own share of the cores instead of torch's default of "all of them"
+    torch.set_num_threads(threads)
+    torch.set_num_interop_threads(1)
+    if pin_cpus and hasattr(os, "sched_setaffinity"):
+        cpus = sorted(os.sched_getaffinity(0))
+        first = (slot * threads) % len(cpus)
+        os.sched_setaffinity(0, cpus[first : first + threads] or cpus)
+
+    import runners  # noqa: F401 --> pay for importing torch + models once per worker, not per job
+
+    print(f"Training worker {os.getpid()} ready ({threads} threads)")
+
+
+def _run_job(kind, data, job_id):
+    from runners import RUNNERS
+
+    try:
+        return RUNNERS[kind](data, callback=lambda metrics: _events.put((job_id, metrics)))
+    finally:
+        _events.put((job_id, None))  # no more metrics for this job
+
+
+class ProcessExecutor:
+    """
+    Runs training jobs in a pool of warm worker processes, each with a fixed
+    torch thread budget so that all workers together never use more threads
+    than the machine has cores. Workers are reused between jobs, so torch and
+    the cached datasets only get loaded once per worker. A worker that dies
+    (killed, out of memory, segfault) only fails the job it was running, and is
+    replaced by a fresh one for the next job.
+
+    :param max_workers: Number of worker processes (capped at the number of cores).
+    :param threads_per_worker: torch threads per worker (default: cores // max_workers).
+    :param pin_cpus: Also pin each worker to its own set of cores.
+    """
+
+    def __init__(self, max_workers=None, threads_per_worker=None, pin_cpus=False):
+        cores = available_cores()
+        self.max_workers = min(max_workers or cores, cores)
+        budget = max(cores // self.max_workers, 1)
+        self.threads_per_worker = min(threads_per_worker or budget, budget)
+
+        self.pin_cpus = pin_cpus
+
+        self._ctx = mp.get_context("spawn")  # forking a process that already has torch threads isn't safe
+        self._events = self._ctx.Queue()
+        # one single-worker pool per slot: when a worker dies, ProcessPoolExecutor marks its whole
+        # pool as broken for good, so this way only that slot's pool has to be replaced
+        self._pools = [self._new_pool(slot) for slot in range(self.max_workers)]
+        self._free = queue.Queue()  # slots not running a job right now
+        for slot in range(self.max_workers):
+            self._free.put(slot)
+
+        self._ids = itertools.count()
+        self._callbacks = {}  # job id -> (callback, event set once all its metrics arrived)
+        self._lock = threading.Lock()
+        threading.Thread(target=self._dispatch, daemon=True).start()
+
+    def run(self, kind, data, callback=None):
+        """Run one job in a worker and block until it's done. Same signature as the runners."""
+        job_id = next(self._ids)
+        finished = threading.Event()
+        with self._lock:
+            self._callbacks[job_id] = (callback, finished)
+        slot = self._free.get()
+        try:
+            result = self._pools[slot].submit(_run_job, kind, data, job_id).result()
+            finished.wait(timeout=5)  # let the last metrics catch up with the result
+            return result
+        except BrokenProcessPool:
+            self._pools[slot].shutdown(wait=False)
+            self._pools[slot] = self._new_pool(slot)
+            raise RuntimeError(
+                "The worker process training this job died (killed, out of memory or crashed)"
+            ) from None
+        finally:
+            self._free.put(slot)
+            with self._lock:
+                self._callbacks.pop(job_id, None)
+
+    def runners(self, kinds):
+        # kind -> function(data, callback), drop-in for runners.RUNNERS in a JobQueue
+        return {kind: (lambda data, callback=None, kind=kind: self.run(kind, data, callback)) for kind in kinds}
+
+    def shutdown(self):
+        for pool in self._pools:
+            pool.shutdown()
+
+    def _new_pool(self, slot):
+        return ProcessPoolExecutor(
+            max_workers=1,
+            mp_context=self._ctx,
+            initializer=_init_worker,
+            initargs=(slot, self._events, self.threads_per_worker, self.pin_cpus),
+        )
+
+    def _dispatch(self):
+        # forwards metrics sent by the workers to the callback of the job they belong to
+        while True:
+            job_id, metrics = self._events.get()
+            with self._lock:
+                callback, finished = self._callbacks.get(job_id, (None, None))
+            if metrics is None:
+                if finished is not None:
+                    finished.set()
+            elif callback is not None:
+                callback(metrics)
@@ -0,0 +1,22 @@
+import os
+import threading
+
+
+def write_atomic(path, write):
+    """
+    Write a file so that readers (other threads, workers, or the next server
+    start) only ever see the old or the complete new version, never half of it.
+
+    :param path: File to (over)write.
+    :param write: Function that writes the contents to the binary file object it gets.
+    """
+    # unique per process + thread, so concurrent writers of the same path don't share a temp file
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp_path, "wb") as file:
+            write(file)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
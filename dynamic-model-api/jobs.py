@@ -0,0 +1,205 @@
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+
+class QueueFullError(Exception):
+    pass
+
+
+class Job:
+    """
+    One submitted training run and everything we know about it so far.
+
+    :param kind: Which runner to use ("train" or "transformertrain").
+    :param data: The request payload.
+    :param job_id: Reuse an existing id (resuming a checkpointed job), new one by default.
+    """
+
+    def __init__(self, kind, data, job_id=None):
+        self.id = job_id or uuid.uuid4().hex
+        self.kind = kind
+        self.data = data
+        self.status = "queued"  # queued --> running --> done / failed
+        self.metrics = []  # per-epoch metrics, appended while the job runs
+        self.result = None  # RESULTS once done
+        self.error = None
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+
+    def wait_time(self):
+        # time spent queued before a worker picked it up
+        return (self.started_at or time.time()) - self.submitted_at
+
+    def run_time(self):
+        if self.started_at is None:
+            return 0.0
+        return (self.finished_at or time.time()) - self.started_at
+
+    def to_dict(self):
+        return {
+            "job_id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "metrics": list(self.metrics),
+            "RESULTS": self.result,
+            "error": self.error,
+            "submitted_at": self.submitted_at,
+            "wait_time": self.wait_time(),
+            "run_time": self.run_time(),
+        }
+
+
+class JobQueue:
+    """
+    Runs training jobs on a bounded pool of worker threads so requests can
+    return a job id straight away.
+
+    :param runners: kind -> function(data, callback) returning RESULTS.
+    :param max_workers: Jobs running at the same time.
+    :param max_queued: Jobs allowed to wait for a worker before submit() refuses more.
+    :param max_kept: Finished jobs remembered for status lookups (oldest dropped first).
+    :param batch_runners: kind -> (key(data), function(datas, callbacks) returning a RESULTS per job).
+        Jobs submitted with "batch": true and the same key within batch_window seconds run as one group.
+    :param batch_window: Seconds a group waits for more jobs before it starts.
+    :param max_batch: Jobs per group, a full group starts right away.
+    """
+
+    def __init__(
+        self,
+        runners,
+        max_workers=2,
+        max_queued=64,
+        max_kept=256,
+        batch_runners=None,
+        batch_window=0.5,
+        max_batch=64,
+    ):
+        self.runners = runners
+        self.max_workers = max_workers
+        self.max_queued = max_queued
+        self.max_kept = max_kept
+        self.batch_runners = batch_runners or {}
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+        self.jobs = OrderedDict()  # job id -> Job, in submission order
+        self._groups = {}  # (kind, key) -> jobs waiting for their batching window to close
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="train-job"
+        )
+
+    def submit(self, kind, data, job_id=None):
+        if kind not in self.runners:
+            raise KeyError(f"Unknown job kind {kind!r}")
+        job = Job(kind, data, job_id)
+        with self._lock:
+            if self.queue_depth() >= self.max_queued:
+                raise QueueFullError(f"Training queue is full ({self.max_queued} jobs waiting)")
+            self.jobs.pop(job.id, None)  # a resumed job goes to the back, like a new one
+            self.jobs[job.id] = job
+            self._forget_finished()
+        group_key = self._group_key(kind, data)
+        if group_key is not None:
+            self._add_to_group(group_key, job)
+        else:
+            self._executor.submit(self._run, job)
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self.jobs.get(job_id)
+
+    def queue_depth(self):
+        return sum(job.status == "queued" for job in self.jobs.values())
+
+    def stats(self):
+        with self._lock:
+            jobs = list(self.jobs.values())
+        return {
+            "max_workers": self.max_workers,
+            "queue_depth": sum(job.status == "queued" for job in jobs),
+            "running": sum(job.status == "running" for job in jobs),
+            "jobs": [
+                {
+                    "job_id": job.id,
+                    "kind": job.kind,
+                    "status": job.status,
+                    "wait_time": job.wait_time(),
+                    "run_time": job.run_time(),
+                }
+                for job in jobs
+            ],
+        }
+
+    def _run(self, job):
+        job.started_at = time.time()
+        job.status = "running"
+        try:
+            # runners name their checkpoints after the job id
+            data = dict(job.data, job_id=job.id)
+            job.result = self.runners[job.kind](data, callback=job.metrics.append)
+            job.status = "done"
+        except Exception as e:
+            print(f"Job {job.id} failed:", e)
+            job.error = str(e)
+            job.status = "failed"
+        finally:
+            job.finished_at = time.time()
+
+    def _group_key(self, kind, data):
+        if not data.get("batch") or kind not in self.batch_runners:
+            return None
+        key = self.batch_runners[kind][0](data)
+        return None if key is None else (kind, key)  # None --> can't be batched, runs on its own
+
+    def _add_to_group(self, group_key, job):
+        with self._lock:
+            group = self._groups.get(group_key)
+            if group is None:
+                group = self._groups[group_key] = []
+                # closes this group (not a later one with the same key) after the window
+                timer = threading.Timer(self.batch_window, self._close_group, (group_key, group))
+                timer.daemon = True
+                timer.start()
+            group.append(job)
+            full = len(group) >= self.max_batch
+        if full:
+            self._close_group(group_key, group)
+
+    def _close_group(self, group_key, group):
+        with self._lock:
+            if self._groups.get(group_key) is not group:  # already closed because it was full
+                return
+            del self._groups[group_key]
+        self._executor.submit(self._run_group, group_key[0], group)
+
+    def _run_group(self, kind, group):
+        for job in group:
+            job.started_at = time.time()
+            job.status = "running"
+        try:
+            results = self.batch_runners[kind][1](
+                [dict(job.data, job_id=job.id) for job in group],
+                [job.metrics.append for job in group],
+            )
+            for job, result in zip(group, results):
+                job.result = result
+                job.status = "done"
+        except Exception as e:
+            print(f"Batch of {len(group)} jobs failed:", e)
+            for job in group:
+                job.error = str(e)
+                job.status = "failed"
+        finally:
+            for job in group:
+                job.finished_at = time.time()
+
+    def _forget_finished(self):
+        # caller holds self._lock
+        finished = [j for j in self.jobs.values() if j.status in ("done", "failed")]
+        for job in finished[: max(len(finished) - self.max_kept, 0)]:
+            del self.jobs[job.id]
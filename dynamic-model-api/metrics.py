@@ -0,0 +1,51 @@
+import torch
+
+
+class MetricsAccumulator:
+    """
+    Running loss / correct / total for a training or test pass, kept as device
+    tensors so the loop never has to wait for the device just to update a
+    counter. Everything comes back to the host in one go in read().
+
+    :param device: Device the model (and so the loss) lives on.
+    """
+
+    def __init__(self, device):
+        # float32 for both so read() is a single transfer (and mps has no float64)
+        self.loss_sum = torch.zeros((), device=device)
+        self.correct = torch.zeros((), device=device)
+        self.batches = 0
+        self.total = 0  # plain int, batch sizes are known on the host already
+
+    def update(self, loss, correct=None, count=0):
+        """
+        :param loss: Mean loss of the batch (tensor, not .item()).
+        :param correct: Number of correct predictions in the batch (tensor), if tracked.
+        :param count: Number of samples in the batch.
+        """
+        self.loss_sum += loss.detach()
+        if correct is not None:
+            self.correct += correct
+        self.batches += 1
+        self.total += count
+
+    def read(self):
+        # the only place that syncs with the device
+        loss_sum, correct = torch.stack([self.loss_sum, self.correct]).tolist()
+        return {
+            "loss": loss_sum / max(self.batches, 1),  # average loss over batches
+            "accuracy": 100 * correct / max(self.total, 1),  # as a percentage
+            "batches": self.batches,
+            "total": self.total,
+        }
+
+    def state_dict(self):
+        # for checkpoints taken in the middle of an epoch
+        loss_sum, correct = torch.stack([self.loss_sum, self.correct]).tolist()
+        return {"loss_sum": loss_sum, "correct": correct, "batches": self.batches, "total": self.total}
+
+    def load_state_dict(self, state):
+        self.loss_sum.fill_(state["loss_sum"])
+        self.correct.fill_(state["correct"])
+        self.batches = state["batches"]
+        self.total = state["total"]
@@ -1,15 +1,21 @@
 import torch
 import torch.nn as nn
-from torch.utils.data import Dataset, DataLoader
-from torchvision import datasets, transforms
-from torchvision.transforms import ToTensor
+from torch.utils.data import Dataset, DataLoader, IterableDataset, get_worker_info
+from torch.utils.data import Sampler, RandomSampler, Subset
 from torch.utils.data import DataLoader, TensorDataset
+from torch.utils.data.dataloader import default_collate
 import torch.nn.functional as F
-from sklearn.model_selection import train_test_split  # --> pip install scikit-learn
+import copy
+import functools
 import math
-from collections import Counter
+import random
 import time
-from params import DATALOADERS, LAYERS, ACTIVATIONS, LOSSES, OPTIMIZERS
+from blocks import CausalDecoderBlock, KVCache, legacy_decoder_step
+from checkpoint import resume_batches, rng_state
+from corpus_cache import load_corpus
+from metrics import MetricsAccumulator
+from params import DATALOADERS, LAYERS, ACTIVATIONS, LOSSES, OPTIMIZERS, DatasetRegistry
+from stopping import StoppingPolicy
 
 # data loader + suggestions
 # expected data example from the api
@@ -56,7 +62,7 @@ class DynamicModel(nn.Module):
                     
 
             elif layer_type in ACTIVATIONS.keys():  # is activation function
-                component = ACTIVATIONS[layer_type]
+                component = ACTIVATIONS[layer_type]()  # fresh module per model
 
             else:
                 print("Invalid layer type")
@@ -92,7 +98,7 @@ class TransformerModel(nn.Module):
             layer_type = l["kind"]
             if layer_type in LAYERS.keys():  # is a layer
                 layer_args = l["args"]
-                if layer_type == "Decoder":
+                if layer_type in ["Decoder", "LegacyDecoder"]:
                     embed_dim, heads, hidden_dim = layer_args
                     self.embed_dim = (
                         embed_dim  # um this updates everytime because im lazy
@@ -117,16 +123,53 @@ class TransformerModel(nn.Module):
         )  # OUTPUT: [batch_size, sequence_length, 100]
         # torch.nn.TransformerDecoderLayer(d_model, nhead, dim_feedforward=2048, dropout=0.1, activation=<function relu>, layer_norm_eps=1e-05, batch_first=False, norm_first=False, bias=True, device=None, dtype=None)
 
-    def forward(self, x):
+    def supports_cache(self):
+        # Decoder blocks cache their keys/values, LegacyDecoder layers go through
+        # legacy_decoder_step (only the post-norm, batch_first layout LAYERS builds)
+        return all(
+            isinstance(d, CausalDecoderBlock)
+            or (isinstance(d, nn.TransformerDecoderLayer) and d.self_attn.batch_first and not d.norm_first)
+            for d in self.decoder_layers
+        )
+
+    def new_cache(self):
+        return KVCache(len(self.decoder_layers))
+
+    def forward(self, x, cache=None):
+        if cache is not None:  # x is just the new tokens, earlier positions come from the cache
+            new_length = x.size(1)
+            x = self.pos_encoder(self.emb(x), offset=cache.length)
+            for decoder, kv in zip(self.decoder_layers, cache.layers):
+                if isinstance(decoder, nn.TransformerDecoderLayer):
+                    x = legacy_decoder_step(decoder, x, kv)
+                else:
+                    x = decoder(x, kv)
+            cache.length += new_length
+            return self.linear_layer(self.dropout_layer(x))
+
         emb = self.emb(x)  # embedding
-        input_mask = self.generate_square_subsequent_mask(x.size(1)).to(
-            x.device
-        )  # make input mask
+        input_mask = None
+        if any(isinstance(d, nn.TransformerDecoderLayer) for d in self.decoder_layers):
+            # only the legacy layers need a mask, the Decoder blocks pass is_causal to the fused SDPA kernel
+            input_mask = self.generate_square_subsequent_mask(
+                x.size(1), x.device, emb.dtype
+            )  # make input mask (memoized)
         x = self.pos_encoder(emb)
         # decoder initialization time!
         # x = self.decoder_layer(x, memory=x, tgt_mask=input_mask, memory_mask=input_mask)
         for decoder in self.decoder_layers:
-            x = decoder(x, memory=x, tgt_mask=input_mask, memory_mask=input_mask)
+            if isinstance(decoder, nn.TransformerDecoderLayer):
+                # the *_is_causal hints let attention skip checking the mask and use its causal kernels
+                x = decoder(
+                    x,
+                    memory=x,
+                    tgt_mask=input_mask,
+                    memory_mask=input_mask,
+                    tgt_is_causal=True,
+                    memory_is_causal=True,
+                )
+            else:
+                x = decoder(x)
 
         x = self.dropout_layer(x)
         out = self.linear_layer(x)
@@ -134,10 +177,12 @@ class TransformerModel(nn.Module):
         return out
 
     @staticmethod
-    def generate_square_subsequent_mask(sz):
-        mask = (torch.triu(torch.ones(sz, sz)) == 1).transpose(0, 1)
+    @functools.lru_cache(maxsize=32)
+    def generate_square_subsequent_mask(sz, device="cpu", dtype=torch.float32):
+        # memoized per (size, device, dtype) --> built once, not on every forward. don't modify in place!
+        mask = (torch.triu(torch.ones(sz, sz, device=device)) == 1).transpose(0, 1)
         mask = (
-            mask.float()
+            mask.to(dtype)
             .masked_fill(mask == 0, float("-inf"))
             .masked_fill(mask == 1, float(0.0))
         )
@@ -169,8 +214,8 @@ class PositionalEncoding(nn.Module):
         pe = pe.unsqueeze(0)
         self.register_buffer("pe", pe)
 
-    def forward(self, x):
-        x = x + self.pe[:, : x.size(1)]  # first generate positional encodings
+    def forward(self, x, offset=0):
+        x = x + self.pe[:, offset : offset + x.size(1)]  # first generate positional encodings
         return self.dropout(x)  # do some dropout i guess
         #     input: [sequence length, batch size, embed dim]
         #     output: [sequence length, batch size, embed dim]
@@ -189,64 +234,251 @@ class TransformerData(Dataset):
             self.sequence_length,
             self.word_to_int,
             self.int_to_word,
-            self.samples,
+            self.ids,
         ) = self.txt_dataset(inp)
 
     def __len__(self):
-        return len(self.samples)  # number of samples
+        return len(self.ids) - self.sequence_length  # number of samples
 
     def __getitem__(self, idx):
-        sample = self.samples[idx]  # retrieving ith sample
-        input_seq = torch.LongTensor(
-            [self.word_to_int[word] for word in sample[:-1]]
-        )  # input
-        target_seq = torch.LongTensor(
-            [self.word_to_int[word] for word in sample[1:]]
-        )  # target words (slides over by 1 each time)
+        # sample i is just a window into the encoded corpus --> slices are views, no copying
+        input_seq = self.ids[idx : idx + self.sequence_length]  # input
+        target_seq = self.ids[
+            idx + 1 : idx + self.sequence_length + 1
+        ]  # target words (slides over by 1 each time)
         # remember --> only one target is being outputted each time!
         return input_seq, target_seq
 
+    def __getitems__(self, indices):
+        # batched fetch used by DataLoader: one gather for the whole batch instead of per-sample slicing
+        starts = torch.as_tensor(indices, dtype=torch.int64).unsqueeze(1)
+        windows = self.ids[starts + torch.arange(self.sequence_length + 1)]
+        return windows[:, :-1], windows[:, 1:]
+
     @staticmethod
-    def txt_dataset(inp):
+    def collate(batch):
+        # __getitems__ already returns stacked (input, target) tensors
+        if isinstance(batch, tuple):
+            return batch
+        return default_collate(batch)
+
+    @staticmethod
+    def file_path(inp):
         if inp == "alice":
-            file_path = "datasets/alice_1.txt"
+            return "datasets/alice_1.txt"
         if inp == "shakespeare":
-            file_path = "datasets/shakespeare.txt"
+            return "datasets/shakespeare.txt"
         if inp == "mehek":
-            file_path = "datasets/mehek.txt"
+            return "datasets/mehek.txt"
+        raise KeyError(f"Unknown text dataset {inp!r}")
 
-        with open(file_path, "r", encoding="utf-8") as file:
-            text = file.read()
-        # tokenize the text into words
-        words = text.split()
-        # count unique words from text
-        word_counts = Counter(words)
-        # make list of the unique words ---> to create a vocabulary
-        vocab = list(word_counts.keys())
-        VOCAB_SIZE = len(vocab)
+    @staticmethod
+    def txt_dataset(inp):
+        file_path = TransformerData.file_path(inp)
+
+        # token ids + vocabulary come from the on-disk cache, tokenized only when the file changes
+        vocab, IDS = load_corpus(file_path)  # IDS = whole corpus as token ids (memory mapped)
         SEQUENCE_LENGTH = 64
+        VOCAB_SIZE = len(vocab)
         WORD_TO_INT = {
             word: i for i, word in enumerate(vocab)
         }  # maps each word to a unique integer index
-        INT_TO_WORD = {
-            i: word for word, i in WORD_TO_INT.items()
-        }  # maps each integer to a word
-        SAMPLES = [
-            words[i : i + SEQUENCE_LENGTH + 1]
-            for i in range(len(words) - SEQUENCE_LENGTH)
-        ]  # training samples of 64 word length
+        INT_TO_WORD = dict(enumerate(vocab))  # maps each integer to a word
+
+        return VOCAB_SIZE, SEQUENCE_LENGTH, WORD_TO_INT, INT_TO_WORD, IDS
+
+
+class StreamingTransformerData(IterableDataset):
+    """
+    TransformerData for corpora that don't fit in memory. The text file is read in
+    chunks and tokenized as it goes, and fixed length windows are yielded through
+    a shuffle buffer. The vocabulary comes from its own streaming pass up front.
+
+    :param inp: Name of the text dataset (alice, shakespeare, ...).
+    :param chunk_size: Characters read from the file at a time.
+    :param shuffle_buffer: Number of windows held back for shuffling (1 = no shuffling).
+    """
+
+    def __init__(self, inp, chunk_size=1 << 20, shuffle_buffer=10000):
+        self.file_path = TransformerData.file_path(inp)
+        self.sequence_length = 64
+        self.chunk_size = chunk_size
+        self.shuffle_buffer = shuffle_buffer
+        self.stride = 1  # only every stride-th window is yielded, see with_stride()
+
+        # vocabulary pass --> same first-appearance word ids as TransformerData
+        self.word_to_int = {}
+        self.n_tokens = 0
+        for words in self.read_words():
+            for word in words:
+                self.word_to_int.setdefault(word, len(self.word_to_int))
+            self.n_tokens += len(words)
+        self.vocab_size = len(self.word_to_int)
+        self.int_to_word = dict(enumerate(self.word_to_int))
+
+    def __len__(self):
+        n_windows = max(self.n_tokens - self.sequence_length, 0)
+        return math.ceil(n_windows / self.stride)  # number of windows per epoch
+
+    def with_stride(self, stride):
+        # shallow copy (shares the vocabulary) that yields every stride-th window
+        strided = copy.copy(self)
+        strided.stride = stride
+        return strided
+
+    def read_words(self):
+        # yields lists of words chunk by chunk, a word cut off at the end of a chunk is carried over
+        carry = ""
+        with open(self.file_path, "r", encoding="utf-8") as file:
+            while True:
+                chunk = file.read(self.chunk_size)
+                if not chunk:
+                    break
+                chunk = carry + chunk
+                words = chunk.split()
+                carry = "" if chunk[-1].isspace() or not words else words.pop()
+                yield words
+        if carry:
+            yield [carry]
+
+    def windows(self):
+        # every (sequence_length + 1) window of the corpus, in order
+        tail = torch.empty(0, dtype=torch.int64)
+        for words in self.read_words():
+            ids = torch.tensor([self.word_to_int[word] for word in words], dtype=torch.int64)
+            buf = torch.cat([tail, ids])
+            if len(buf) > self.sequence_length:
+                yield from buf.unfold(0, self.sequence_length + 1, 1)
+            tail = buf[-self.sequence_length :]
+
+    def __iter__(self):
+        worker = get_worker_info()
+        worker_id, num_workers = (0, 1) if worker is None else (worker.id, worker.num_workers)
+        # drawn from torch's RNG so every epoch (and every worker) gets a different order
+        rng = random.Random(int(torch.randint(2**62, ()).item()))
+
+        buffer = []
+        for i, window in enumerate(self.windows()):
+            if i % self.stride:
+                continue
+            if (i // self.stride) % num_workers != worker_id:  # each worker only handles its own share of windows
+                continue
+            buffer.append(window.clone())  # clone so the chunk tensor can be freed
+            if len(buffer) >= self.shuffle_buffer:
+                j = rng.randrange(len(buffer))
+                buffer[j], buffer[-1] = buffer[-1], buffer[j]
+                window = buffer.pop()
+                yield window[:-1], window[1:]
+        rng.shuffle(buffer)
+        for window in buffer:
+            yield window[:-1], window[1:]
+
+
+class StridedSampler(Sampler):
+    """
+    Samples window offsets stride apart (instead of every word offset), starting
+    from a random phase and in random order each epoch.
+
+    :param n: Number of windows in the dataset.
+    :param stride: Distance in words between consecutive windows.
+    :param shuffle: Randomize the phase and the order every epoch.
+    :param generator: torch.Generator for the phase + order (default: the global RNG).
+    """
+
+    def __init__(self, n, stride, shuffle=True, generator=None):
+        self.n = n
+        self.stride = stride
+        self.shuffle = shuffle
+        self.generator = generator
+        self.count = max(n // stride, 1) if n else 0  # same number of windows every epoch
 
-        return VOCAB_SIZE, SEQUENCE_LENGTH, WORD_TO_INT, INT_TO_WORD, SAMPLES
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        max_phase = self.n - (self.count - 1) * self.stride
+        phase = (
+            int(torch.randint(max_phase, (), generator=self.generator).item())
+            if self.shuffle and max_phase > 1
+            else 0
+        )
+        offsets = torch.arange(self.count) * self.stride + phase
+        if self.shuffle:
+            offsets = offsets[torch.randperm(self.count, generator=self.generator)]
+        return iter(offsets.tolist())
+
+
+# built TransformerData per corpus, shared by training + inference so a corpus is only prepared once per process
+# (streaming versions are under "<name>:stream")
+TRANSFORMER_DATA = DatasetRegistry(
+    {
+        **{
+            name: (lambda name=name: TransformerData(name))
+            for name in ("alice", "shakespeare", "mehek")
+        },
+        **{
+            f"{name}:stream": (lambda name=name: StreamingTransformerData(name))
+            for name in ("alice", "shakespeare", "mehek")
+        },
+    },
+    max_loaded=2,
+)
 
 
 # MOVES MODEL TO DEVICE
 class TransformerTrain:  # input is DATALOADERS
-    def __init__(self, model, inp, loss, optimizer, batch_size):
-        self.dataset = TransformerData(inp)
+    def __init__(
+        self,
+        model,
+        inp,
+        loss,
+        optimizer,
+        batch_size,
+        dataset=None,
+        num_workers=0,
+        stride=1,
+        sampling="stride",
+        windows_per_epoch=None,
+        autotune=False,
+    ):
+        # pass in a prebuilt TransformerData (or StreamingTransformerData) to skip the lookup
+        self.dataset = dataset if dataset is not None else TRANSFORMER_DATA[inp]
+
+        # which windows make up an epoch:
+        #   "stride" --> every stride-th word offset (stride=1 is every offset, like before)
+        #   "random" --> windows_per_epoch windows at random offsets
+        if isinstance(self.dataset, IterableDataset):  # streaming data shuffles itself
+            if sampling != "stride":
+                raise ValueError("Streaming datasets only support stride sampling")
+            if stride > 1:
+                self.dataset = self.dataset.with_stride(stride)
+            sampler = None
+        elif sampling == "random":
+            sampler = RandomSampler(
+                self.dataset, num_samples=windows_per_epoch or len(self.dataset)
+            )
+        elif sampling == "stride":
+            sampler = StridedSampler(len(self.dataset), stride)
+        else:
+            raise ValueError(f"Unknown sampling mode {sampling!r}")
+
+        loader_settings = {"num_workers": num_workers}
+        if autotune:  # benchmarked once per (corpus, batch size, host), then read from the cache
+            from autotune import tuned_loader_settings
+
+            loader_settings = tuned_loader_settings(
+                self.dataset,
+                batch_size,
+                f"{inp}:stream" if isinstance(self.dataset, IterableDataset) else inp,
+                sampler=sampler,
+                collate_fn=TransformerData.collate,
+            )
         self.dataloader = DataLoader(
             self.dataset,
             batch_size=batch_size,
-            shuffle=True,
+            sampler=sampler,
+            collate_fn=TransformerData.collate,
+            **loader_settings,
         )
 
         self.device = (  # for GPU access --> works with CPU as well
@@ -268,16 +500,54 @@ class TransformerTrain:  # input is DATALOADERS
 
         # print(model)
 
-    def train(self, n_epochs):
-        size = len(self.dataloader.dataset)
+    def train(
+        self, n_epochs, callback=None, log_every=0, stopping=None, checkpointer=None, resume=None
+    ):
+        # callback gets per-epoch metrics, plus batch metrics every log_every batches (0 = never)
+        # checkpointer saves the state below every so often, resume is such a saved state
+        stopping = stopping or StoppingPolicy()  # no patience / budgets unless the request asks
+        n_epochs = stopping.start(n_epochs)
 
         self.model.train()
 
         train_loss = []
-
-        for epoch in range(n_epochs):
-            running_loss = 0
-            for input_seq, target_seq in self.dataloader:
+        tokens = 0  # input tokens actually fed to the model
+        start_epoch = 0
+        metrics, epoch_rng = MetricsAccumulator(self.device), None  # per epoch, see below
+
+        if resume is not None:
+            self.model.load_state_dict(resume["model"])
+            self.optimizer.load_state_dict(resume["optimizer"])
+            stopping.load_state_dict(resume["stopping"])
+            train_loss = resume["history"]["train_loss"]
+            tokens = resume["history"]["tokens"]
+            start_epoch = n_epochs if resume.get("finished") else resume["epoch"]
+            print(f"Resuming at epoch {start_epoch + 1}, batch {resume['batch'] + 1}")
+
+        def checkpoint_state(epoch, batch):
+            return {
+                "model": self.model.state_dict(),
+                "optimizer": self.optimizer.state_dict(),
+                "epoch": epoch,  # epoch in progress (0-based)
+                "batch": batch,  # batches of it already trained on
+                "epoch_rng": epoch_rng,
+                "rng": rng_state(),
+                "metrics": metrics.state_dict(),
+                "stopping": stopping.state_dict(),
+                "history": {"train_loss": list(train_loss), "tokens": tokens},
+            }
+
+        for epoch in range(start_epoch, n_epochs):
+            metrics = MetricsAccumulator(self.device)  # running loss stays on the device
+            epoch_resume = resume if resume is not None and epoch == resume["epoch"] else None
+            if epoch_resume is not None:
+                metrics.load_state_dict(epoch_resume["metrics"])
+            epoch_rng = epoch_resume["epoch_rng"] if epoch_resume else rng_state()
+            epoch_start = time.perf_counter()
+            epoch_samples = 0
+            for batch, (input_seq, target_seq) in resume_batches(self.dataloader, epoch_resume):
+                tokens += input_seq.numel()
+                epoch_samples += input_seq.size(0)
                 input_seq, target_seq = (
                     input_seq.to(self.device),
                     target_seq.to(self.device),
@@ -291,25 +561,104 @@ class TransformerTrain:  # input is DATALOADERS
                 self.optimizer.zero_grad()
                 loss.backward()
                 self.optimizer.step()
-                running_loss += loss.detach().cpu().numpy()
-            epoch_loss = running_loss / len(self.dataloader)
+                metrics.update(loss)
+                if callback is not None and log_every and (batch + 1) % log_every == 0:
+                    callback(
+                        {
+                            "event": "batch",
+                            "epoch": epoch + 1,
+                            "batch": batch + 1,
+                            "loss": metrics.read()["loss"],  # only syncs every log_every batches
+                            "samples_per_sec": epoch_samples
+                            / (time.perf_counter() - epoch_start),
+                        }
+                    )
+                stop = stopping.step()  # out of time / steps --> this epoch ends here
+                if checkpointer is not None:
+                    checkpointer.step(lambda: checkpoint_state(epoch, batch + 1))
+                if stop:
+                    break
+            epoch_loss = metrics.read()["loss"]
+            epoch_time = time.perf_counter() - epoch_start
             print(f"Epoch {epoch} loss: {epoch_loss:.3f}")
             train_loss.append(epoch_loss)
+            if callback is not None:
+                callback(
+                    {
+                        "event": "epoch",
+                        "epoch": epoch + 1,
+                        "train_loss": epoch_loss,
+                        "samples_per_sec": epoch_samples / epoch_time,
+                        "tokens_per_sec": epoch_samples
+                        * self.dataset.sequence_length
+                        / epoch_time,
+                    }
+                )
+            if stopping.epoch_end(epoch + 1, {"train_loss": epoch_loss}):
+                print(f"Stopping after epoch {epoch + 1}: {stopping.reason}")
+                break
+
+        if checkpointer is not None:  # a resume of a finished run just hands back its results
+            checkpointer.close(checkpoint_state(len(train_loss), 0))
 
         print("Done!")
         # torch.cuda.empty_cache()
 
         # FOR WHEN INFERENCE IS NOT DYNAMIC
-        return {"train_loss": train_loss}  # return the training loss for each epoch
+        return {
+            "train_loss": train_loss,  # return the training loss for each epoch
+            "tokens_per_epoch": tokens // max(len(train_loss), 1),
+            **stopping.summary(epochs_run=len(train_loss)),
+            **({"checkpoint": checkpointer.info()} if checkpointer is not None else {}),
+        }
 
     # FOR LATER WHEN INFERENCE IS DYNAMIC
     # return {"train_loss": train_loss, "state_dict": self.model.state_dict(), "vocab_size": self.dataset.vocab_size, "sequence_length": self.dataset.sequence_length, "int_to_word": self.dataset.int_to_word}
     # returns the model state dict, vocab size, sequence_length, and int_to_word for inference
 
 
+def stratified_indices(labels, size, seed=0):
+    """
+    Indices of a fixed-size subsample with the same class balance as labels.
+    Seeded, so every epoch (and every job) is evaluated on the same samples.
+
+    :param labels: Class label per sample (tensor or list).
+    :param size: Number of samples to keep.
+    :param seed: Seed for picking samples within each class.
+    """
+    labels = torch.as_tensor(labels).reshape(-1).cpu()
+    if size >= len(labels):
+        return list(range(len(labels)))
+    generator = torch.Generator().manual_seed(seed)
+    classes, counts = labels.unique(return_counts=True)
+    share = counts.double() * size / len(labels)
+    quota = share.floor().long()
+    # rounding leftovers go to the classes that lost the most to floor()
+    quota[(share - quota).argsort(descending=True)[: size - int(quota.sum())]] += 1
+    picked = []
+    for cls, n in zip(classes, quota.tolist()):
+        idx = (labels == cls).nonzero().flatten()
+        picked.append(idx[torch.randperm(len(idx), generator=generator)[:n]])
+    return torch.cat(picked).sort().values.tolist()
+
+
 class Train:
-    def __init__(self, model, input, loss, optimizer, batch_size):
+    def __init__(
+        self,
+        model,
+        input,
+        loss,
+        optimizer,
+        batch_size,
+        fast_data=False,
+        autotune=False,
+        eval_every=1,  # evaluate every N epochs (and always after the last one)
+        eval_subsample=None,  # evaluate on a fixed stratified subsample of this many test samples
+    ):
+        if eval_every < 1:
+            raise ValueError(f"eval_every must be at least 1, got {eval_every}")
         self.input = input
+        self.eval_every = eval_every
         ds = DATALOADERS[input]
 
         self.device = (  # for GPU access --> works with CPU as well
@@ -326,6 +675,8 @@ class Train:
 
         # preprocessing data here!!!
         if input == "pima":
+            from sklearn.model_selection import train_test_split  # --> pip install scikit-learn
+
             X = ds["X"]
             y = ds["y"]
 
@@ -342,20 +693,55 @@ class Train:
             # create dataset objects
             train_dataset = TensorDataset(X_train_tensor, y_train_tensor)
             test_dataset = TensorDataset(X_test_tensor, y_test_tensor)
+            if eval_subsample:
+                test_dataset = Subset(
+                    test_dataset, stratified_indices(y_test_tensor, eval_subsample)
+                )
             # create dataLoader objects
-            self.train_loader = DataLoader(train_dataset, batch_size=batch_size, shuffle=True)
+            loader_settings = self.loader_settings(autotune, train_dataset, batch_size)
+            self.train_loader = DataLoader(
+                train_dataset, batch_size=batch_size, shuffle=True, **loader_settings
+            )
             self.test_loader = DataLoader(
-                test_dataset, batch_size=batch_size, shuffle=False
+                test_dataset, batch_size=batch_size, shuffle=False, **loader_settings
             )
         else:
             train_set = ds["train"]
             test_set = ds["test"]
-            self.train_loader = DataLoader(
-                train_set, batch_size=batch_size, shuffle=True
-            )
-            self.test_loader = DataLoader(
-                test_set, batch_size=batch_size, shuffle=False
-            )
+            self.train_loader = None
+            if fast_data:  # preprocessed uint8 tensors that already live on the device
+                try:
+                    from tensor_cache import cached_tensors, TensorBatchLoader
+
+                    self.train_loader = TensorBatchLoader(
+                        *cached_tensors(train_set, self.device), batch_size, shuffle=True
+                    )
+                    test_images, test_labels = cached_tensors(test_set, self.device)
+                    if eval_subsample:
+                        idx = torch.tensor(
+                            stratified_indices(test_labels, eval_subsample),
+                            device=test_labels.device,
+                        )
+                        test_images, test_labels = test_images[idx], test_labels[idx]
+                    self.test_loader = TensorBatchLoader(
+                        test_images, test_labels, batch_size, shuffle=False
+                    )
+                except Exception as e:
+                    print(f"Tensor cache unavailable for {input}, using DataLoader: {e}")
+                    self.train_loader = None
+
+            if self.train_loader is None:
+                if eval_subsample:
+                    test_set = Subset(
+                        test_set, stratified_indices(test_set.targets, eval_subsample)
+                    )
+                loader_settings = self.loader_settings(autotune, train_set, batch_size)
+                self.train_loader = DataLoader(
+                    train_set, batch_size=batch_size, shuffle=True, **loader_settings
+                )
+                self.test_loader = DataLoader(
+                    test_set, batch_size=batch_size, shuffle=False, **loader_settings
+                )
 
         self.loss_fn = LOSSES[loss]
         self.optimizer = OPTIMIZERS[optimizer["kind"]](
@@ -363,17 +749,44 @@ class Train:
         )
 
         self.final_loss = -1
+        # goes into RESULTS so numbers from different runs can be compared fairly
+        self.eval_policy = {
+            "split": "test",
+            "every": eval_every,
+            "subsample": eval_subsample,
+            "samples": len(self.test_loader.dataset),
+        }
+
+    def loader_settings(self, autotune, dataset, batch_size):
+        # num_workers / pin_memory / prefetching for this dataset, benchmarked once per host
+        if not autotune:
+            return {}
+        from autotune import tuned_loader_settings
+
+        return tuned_loader_settings(dataset, batch_size, self.input, shuffle=True)
         
         
-    def train(self, n_epochs, batch_size):
-        size = len(self.train_loader.dataset)
+    def train(
+        self,
+        n_epochs,
+        batch_size,
+        callback=None,
+        log_every=0,
+        epoch=None,
+        stopping=None,
+        on_step=None,
+        resume=None,
+    ):
+        # callback gets batch metrics every log_every batches (0 = never)
+        # on_step(batches_done, metrics) after every step, resume = checkpoint taken in this epoch
+        start = time.perf_counter()
         # num_batches = len(self.train_loader)
         self.model.train()
-        train_loss = 0
-        correct = 0
-        total = 0
+        metrics = MetricsAccumulator(self.device)  # loss / correct / total stay on the device
+        if resume is not None:
+            metrics.load_state_dict(resume["metrics"])
 
-        for batch, (X, y) in enumerate(self.train_loader):
+        for batch, (X, y) in resume_batches(self.train_loader, resume):
             X, y = X.to(self.device), y.to(self.device)
             # Compute prediction error
             pred = self.model(X)
@@ -382,7 +795,6 @@ class Train:
             loss.backward()
             self.optimizer.step()
             self.optimizer.zero_grad()
-            train_loss += loss.item()
 
             if self.input == "pima":
                 predicted = (
@@ -391,65 +803,155 @@ class Train:
             else:
                 _, predicted = torch.max(pred, 1)  # for multi-class classification
 
-            # Get the predicted class (index with max value)
-            correct += (predicted == y).sum().item()  # Count correct predictions
-            total += y.size(0)  # Count total predictions
+            # Get the predicted class (index with max value), count correct + total predictions
+            metrics.update(loss, (predicted == y).sum(), y.size(0))
+
+            if callback is not None and log_every and (batch + 1) % log_every == 0:
+                running = metrics.read()  # only syncs every log_every batches
+                callback(
+                    {
+                        "event": "batch",
+                        "epoch": epoch,
+                        "batch": batch + 1,
+                        "loss": running["loss"],
+                        "accuracy": running["accuracy"],
+                        "samples_per_sec": running["total"] / (time.perf_counter() - start),
+                    }
+                )
+            stop = stopping is not None and stopping.step()  # out of time / steps
+            if on_step is not None:
+                on_step(batch + 1, metrics)
+            if stop:
+                break
 
-            if batch % 100 == 0:
-                loss, current = loss.item(), (batch + 1) * len(X)
-                # print(f"loss: {loss:>7f}  [{current:>5d}/{size:>5d}]")
+        # Average loss over all batches, accuracy as a percentage
+        result = metrics.read()
+        return result["loss"], result["accuracy"]
 
-        # Average loss over all batches
-        avg_train_loss = train_loss / len(self.train_loader)
-        # Calculate accuracy as a percentage
-        avg_acc = 100 * correct / total
-        return avg_train_loss, avg_acc
-        
     def test(self, n_epochs, batch_size):
-        size = len(self.test_loader.dataset)
-        num_batches = len(self.test_loader)
         self.model.eval()  # model mode change is especially important for dropout layers
-        test_loss, correct = 0, 0
+        metrics = MetricsAccumulator(self.device)
 
         with torch.no_grad():
             for X, y in self.test_loader:
                 X, y = X.to(self.device), y.to(self.device)
                 # Compute prediction error
                 pred = self.model(X)
-                test_loss += self.loss_fn(pred, y).item()
                 if self.input == "pima":
                     predicted = (pred > 0.5).type(torch.float)
-                    correct += (predicted == y).sum().item()
                 else:
-                    correct += (
-                        (pred.argmax(1) == y).type(torch.float).sum().item()
-                    )  # for accuracy
-
-        test_loss /= num_batches
-        correct /= size
-        avg_acc = 100 * correct
+                    predicted = pred.argmax(1)  # for accuracy
+                metrics.update(self.loss_fn(pred, y), (predicted == y).sum(), y.size(0))
 
         # Average loss over all batches
-        avg_test_loss = test_loss / len(self.test_loader)
-        return avg_test_loss, avg_acc
-
-    def train_test_log(self, n_epochs, batch_size):
+        result = metrics.read()
+        return result["loss"], result["accuracy"]
+
+    def train_test_log(
+        self,
+        n_epochs,
+        batch_size,
+        callback=None,
+        log_every=0,
+        stopping=None,
+        checkpointer=None,
+        resume=None,
+    ):
+        # checkpointer saves the state below every so often, resume is such a saved state
+        stopping = stopping or StoppingPolicy()  # no patience / budgets unless the request asks
+        n_epochs = stopping.start(n_epochs)
         train_losses = []
         train_accs = []
         test_losses = []
         test_accs = []
-        for t in range(n_epochs):
+        eval_epochs = []  # epochs that were followed by an evaluation
+        start_epoch = 0
+
+        if resume is not None:
+            self.model.load_state_dict(resume["model"])
+            self.optimizer.load_state_dict(resume["optimizer"])
+            stopping.load_state_dict(resume["stopping"])
+            history = resume["history"]
+            train_losses, train_accs = history["train_losses"], history["train_accs"]
+            test_losses, test_accs = history["test_losses"], history["test_accs"]
+            eval_epochs = history["eval_epochs"]
+            start_epoch = n_epochs if resume.get("finished") else resume["epoch"]
+            print(f"Resuming at epoch {start_epoch + 1}, batch {resume['batch'] + 1}")
+
+        def checkpoint_state(epoch, batch, metrics=None, epoch_rng=None):
+            return {
+                "model": self.model.state_dict(),
+                "optimizer": self.optimizer.state_dict(),
+                "epoch": epoch,  # epoch in progress (0-based)
+                "batch": batch,  # batches of it already trained on
+                "epoch_rng": epoch_rng,
+                "rng": rng_state(),
+                "metrics": metrics.state_dict() if metrics is not None else None,
+                "stopping": stopping.state_dict(),
+                "history": {
+                    "train_losses": list(train_losses),
+                    "train_accs": list(train_accs),
+                    "test_losses": list(test_losses),
+                    "test_accs": list(test_accs),
+                    "eval_epochs": list(eval_epochs),
+                },
+            }
+
+        for t in range(start_epoch, n_epochs):
             print(f"Epoch {t + 1}/{n_epochs}...")
-            avg_train_loss, train_avg_acc = self.train(n_epochs, batch_size)
+            epoch_start = time.perf_counter()
+            epoch_resume = resume if resume is not None and t == resume["epoch"] else None
+            epoch_rng = epoch_resume["epoch_rng"] if epoch_resume else rng_state()
+            on_step = None
+            if checkpointer is not None:
+                on_step = lambda batch, metrics: checkpointer.step(
+                    lambda: checkpoint_state(t, batch, metrics, epoch_rng)
+                )
+            avg_train_loss, train_avg_acc = self.train(
+                n_epochs,
+                batch_size,
+                callback=callback,
+                log_every=log_every,
+                epoch=t + 1,
+                stopping=stopping,
+                on_step=on_step,
+                resume=epoch_resume,
+            )
+            samples_per_sec = len(self.train_loader.dataset) / (
+                time.perf_counter() - epoch_start
+            )
             print(f"Train Loss: {avg_train_loss:.4f}, Train Accuracy: {train_avg_acc:.2f}%\n")
-            avg_test_loss, test_avg_acc = self.test(n_epochs, batch_size)
-            print(f"Test Loss: {avg_test_loss:.4f}, Test Accuracy: {test_avg_acc:.2f}%\n")
+            avg_test_loss, test_avg_acc = None, None
+            # a run that's about to stop on its budget still gets its final evaluation
+            last_epoch = t + 1 == n_epochs or stopping.reason is not None
+            if (t + 1) % self.eval_every == 0 or last_epoch:
+                avg_test_loss, test_avg_acc = self.test(n_epochs, batch_size)
+                print(f"Test Loss: {avg_test_loss:.4f}, Test Accuracy: {test_avg_acc:.2f}%\n")
+                test_losses.append(avg_test_loss)
+                test_accs.append(test_avg_acc)
+                eval_epochs.append(t + 1)
 
             # Store losses
             train_losses.append(avg_train_loss)
             train_accs.append(train_avg_acc)
-            test_losses.append(avg_test_loss)
-            test_accs.append(test_avg_acc)
+            if callback is not None:  # e.g. job progress
+                callback(
+                    {
+                        "event": "epoch",
+                        "epoch": t + 1,
+                        "samples_per_sec": samples_per_sec,
+                        "train_loss": avg_train_loss,
+                        "train_acc": train_avg_acc,
+                        "test_loss": avg_test_loss,
+                        "test_acc": test_avg_acc,
+                    }
+                )
+            if stopping.epoch_end(t + 1, {"train_loss": avg_train_loss, "test_loss": avg_test_loss}):
+                print(f"Stopping after epoch {t + 1}: {stopping.reason}")
+                break
+
+        if checkpointer is not None:  # a resume of a finished run just hands back its results
+            checkpointer.close(checkpoint_state(len(train_losses), 0))
 
         # calculate average accuracy and average loss
         avg_train_acc = sum(train_accs) / len(train_accs)
@@ -467,14 +969,24 @@ class Train:
             "avg_test_loss": avg_test_loss,
             "avg_train_acc": avg_train_acc,
             "avg_test_acc": avg_test_acc,
+            "eval_epochs": eval_epochs,  # test_losses[i] belongs to epoch eval_epochs[i]
+            "eval_policy": self.eval_policy,
+            **stopping.summary(epochs_run=len(train_losses)),
+            **({"checkpoint": checkpointer.info()} if checkpointer is not None else {}),
         }
 
         # can add more information to this dictionary, like the saved model, best epochs, etc.
 
 
 class Inference:
-    def __init__(self, model, word_to_int, int_to_word, sequence_length):
+    def __init__(
+        self, model, word_to_int=None, int_to_word=None, sequence_length=None, dataset=None
+    ):
         self.model = model
+        if dataset is not None:  # take the vocabulary straight from a prebuilt TransformerData
+            word_to_int = dataset.word_to_int
+            int_to_word = dataset.int_to_word
+            sequence_length = dataset.sequence_length
         self.word_to_int = word_to_int
         self.int_to_word = int_to_word
         self.sequence_length = sequence_length
@@ -508,6 +1020,9 @@ class Inference:
 
     def generate_text(self, sentence, generate_length, temperature=1.0, top_k=None):
         self.model.eval()
+        if self.model.supports_cache():
+            return self.generate_text_cached(sentence, generate_length, temperature, top_k)
+
         sample = sentence
         for _ in range(generate_length):
             int_vector = self.return_int_vector(sample)
@@ -523,6 +1038,37 @@ class Inference:
         # print('\n')
         return sample  # return the generated text
 
+    def generate_text_cached(self, sentence, generate_length, temperature=1.0, top_k=None):
+        """
+        Same sampling as generate_text, but each step only runs the newest token
+        through the model and reuses the keys/values of everything before it.
+
+        Identical to generate_text until the text is sequence_length tokens long.
+        After that generate_text slides its window by one token per step, which
+        shifts every position and can't be cached. This instead restarts the cache
+        from the newest sequence_length // 2 tokens whenever it's full, so later
+        tokens are conditioned on between sequence_length // 2 and sequence_length
+        tokens of context instead of always sequence_length.
+        """
+        device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        sample = sentence
+        with torch.no_grad():
+            cache = self.model.new_cache()
+            predictions = self.model(self.return_int_vector(sample).to(device), cache)
+            for _ in range(generate_length):
+                next_token = self.sample_next(predictions, temperature, top_k)
+                sample += " " + self.int_to_word[next_token]
+                if cache.length >= self.sequence_length:
+                    # out of positions --> start a fresh cache from the newest half of the context,
+                    # so rebuilding it is paid once every sequence_length // 2 tokens
+                    context = self.return_int_vector(sample)[:, -(self.sequence_length // 2) :]
+                    cache = self.model.new_cache()
+                    predictions = self.model(context.to(device), cache)
+                else:
+                    next_input = torch.tensor([[next_token]], device=device)
+                    predictions = self.model(next_input, cache)
+        return sample
+
     # def text_generator(sentence, generate_length, temperature=1.0, top_k=None):
     # model.eval()
     # sample = sentence
@@ -570,7 +1116,7 @@ if __name__ == "__main__":
     if torch.cuda.is_available():
         torch.cuda.empty_cache()  # clear GPU memory
 
-    dataset = TransformerData(params["input"])
+    dataset = TRANSFORMER_DATA[params["input"]]
 
     model = TransformerModel(
         params["layers"], dataset.vocab_size, dataset.sequence_length
@@ -584,6 +1130,7 @@ if __name__ == "__main__":
         params["loss"],
         params["optimizer"],
         params["batch_size"],
+        dataset=dataset,
     )
 
     losses = t.train(params["epoch"])
@@ -596,11 +1143,7 @@ if __name__ == "__main__":
     torch.save(model.state_dict(), "datasets/model3.pth")
     print("Model saved successfully!")
 
-    word_to_int = dataset.word_to_int
-    int_to_word = dataset.int_to_word
-    SEQUENCE_LENGTH = dataset.sequence_length
-
-    text_gen = Inference(model, word_to_int, int_to_word, SEQUENCE_LENGTH)
+    text_gen = Inference(model, dataset=dataset)
     sample = text_gen.generate_text(
         prompt, generate_length, temperature=temperature, top_k=None
     )
@@ -1,83 +1,162 @@
 import torch
 import torch.nn as nn
 import torch.optim as optim
-import pandas as pd
-from collections import Counter
-
-from torch.utils.data import Dataset
-from torchvision import datasets
-from torch.utils.data import DataLoader
-from torchvision import datasets, transforms
-from torchvision.transforms import ToTensor
-import torch.nn.functional as F
-import matplotlib.pyplot as plt
-
-            
-    
-
-DATALOADERS = {
-    "alice": { # dataset for decoder-only transformer, demonstrating text generation
-        "file": "datasets/alice_1.txt"
-    },
-    "shakespeare":{
-        "file": "datasets/shakespeare.txt"
-    },
-    "pima": {
-        "X": pd.read_csv("datasets/pima-indians-diabetes.csv").iloc[:, :-1].values,
-        "y": pd.read_csv("datasets/pima-indians-diabetes.csv").iloc[:, -1].values,
-    },
-    "MNIST": {
-        "train": datasets.MNIST(
-            root="data",
-            train=True,
-            download=True,
-            transform=transforms.Compose([transforms.ToTensor()]),
-        ),
-        "test": datasets.MNIST(
-            root="data",
-            train=True,
-            download=True,
-            transform=transforms.Compose([transforms.ToTensor()]),
-        ),
-    },
-    "FashionMNIST": {
-        "train": datasets.FashionMNIST(
-            root="data",
-            train=True,
-            download=True,
-            transform=transforms.Compose([transforms.ToTensor()]),
-        ),
-        "test": datasets.FashionMNIST(
-            root="data",
-            train=True,
-            download=True,
-            transform=transforms.Compose([transforms.ToTensor()]),
-        ),
-    },
-    "CIFAR10": {
-        "train": datasets.CIFAR10(
-            root="data",
-            train=True,
-            download=True,
-            transform=transforms.Compose([transforms.ToTensor()]),
-        ),
-        "test": datasets.CIFAR10(
-            root="data",
-            train=True,
-            download=True,
-            transform=transforms.Compose([transforms.ToTensor()]),
-        ),
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Mapping
+from blocks import CausalDecoderBlock
+
+# pandas + torchvision are imported inside the dataset factories below so that
+# importing params (and app/models/generate) doesn't pay for them up front
+
+
+class DatasetRegistry(Mapping):
+    """
+    Lazy stand-in for the old DATALOADERS dict. Each entry is a factory that is
+    only called the first time DATALOADERS[name] is looked up, and the result is
+    memoized for the rest of the process.
+
+    :param factories: name -> zero-argument callable returning the dataset entry.
+    :param max_loaded: Max number of materialized entries kept around. Least
+        recently used entries are evicted past this (None = never evict).
+    :param pinned: Names that are cheap to keep and never get evicted.
+    """
+
+    def __init__(self, factories, max_loaded=2, pinned=()):
+        self.factories = dict(factories)
+        self.max_loaded = max_loaded
+        self.pinned = set(pinned)
+        self.load_times = {}  # name -> seconds spent in the factory (last load)
+        self.load_counts = {}  # name -> number of times the factory ran
+        self._loaded = OrderedDict()  # name -> entry, in LRU order
+        self._lock = threading.Lock()
+        self._loading = {}  # name -> lock, so concurrent first lookups only load once
+
+    def __getitem__(self, name):
+        if name not in self.factories:
+            raise KeyError(f"Unknown dataset {name!r}")
+
+        with self._lock:
+            if name in self._loaded:
+                self._loaded.move_to_end(name)
+                return self._loaded[name]
+            name_lock = self._loading.setdefault(name, threading.Lock())
+
+        with name_lock:  # only the first caller runs the factory, the rest wait for it
+            with self._lock:
+                if name in self._loaded:
+                    self._loaded.move_to_end(name)
+                    return self._loaded[name]
+
+            start = time.perf_counter()
+            entry = self.factories[name]()
+            elapsed = time.perf_counter() - start
+
+            with self._lock:
+                self.load_times[name] = elapsed
+                self.load_counts[name] = self.load_counts.get(name, 0) + 1
+                self._loaded[name] = entry
+                self._evict()
+            print(f"Loaded dataset {name} in {elapsed:.2f}s")
+            return entry
+
+    def __iter__(self):
+        return iter(self.factories)
+
+    def __len__(self):
+        return len(self.factories)
+
+    def __contains__(self, name):
+        return name in self.factories  # doesn't trigger a load
+
+    def is_loaded(self, name):
+        with self._lock:
+            return name in self._loaded
+
+    def evict(self, name=None):
+        """Drop one materialized entry (or all of them if name is None)."""
+        with self._lock:
+            if name is None:
+                self._loaded.clear()
+            else:
+                self._loaded.pop(name, None)
+
+    def _evict(self):
+        # caller holds self._lock
+        if self.max_loaded is None:
+            return
+        evictable = [n for n in self._loaded if n not in self.pinned]
+        while len(evictable) > self.max_loaded:
+            oldest = evictable.pop(0)
+            del self._loaded[oldest]
+            print(f"Evicted dataset {oldest} from the cache")
+
+    def stats(self):
+        with self._lock:
+            return {
+                "loaded": list(self._loaded),
+                "load_times": dict(self.load_times),
+                "load_counts": dict(self.load_counts),
+                "max_loaded": self.max_loaded,
+            }
+
+
+def _pima():
+    import pandas as pd
+
+    df = pd.read_csv("datasets/pima-indians-diabetes.csv")  # parse the csv once
+    return {
+        "X": df.iloc[:, :-1].values,
+        "y": df.iloc[:, -1].values,
+    }
+
+
+def _torchvision(name):
+    def factory():
+        from torchvision import datasets, transforms
+
+        dataset_cls = getattr(datasets, name)
+        return {
+            split: dataset_cls(
+                root="data",
+                train=split == "train",  # "test" is the real held-out split (10k images)
+                download=True,
+                transform=transforms.Compose([transforms.ToTensor()]),
+            )
+            for split in ("train", "test")
+        }
+
+    return factory
+
+
+DATALOADERS = DatasetRegistry(
+    {
+        "alice": lambda: {  # dataset for decoder-only transformer, demonstrating text generation
+            "file": "datasets/alice_1.txt"
+        },
+        "shakespeare": lambda: {
+            "file": "datasets/shakespeare.txt"
+        },
+        "pima": _pima,
+        "MNIST": _torchvision("MNIST"),
+        "FashionMNIST": _torchvision("FashionMNIST"),
+        "CIFAR10": _torchvision("CIFAR10"),
     },
-}
+    max_loaded=2,  # image datasets are big, keep at most two of them in memory
+    pinned=("alice", "shakespeare", "pima"),
+)
 
 
+# factories like LAYERS: every model gets its own modules (PReLU has weights, sharing one
+# instance would let concurrent jobs train each other's parameters)
 ACTIVATIONS = {
-    "ReLU": nn.ReLU(),
-    "Sigmoid": nn.Sigmoid(),
-    "Tanh": nn.Tanh(),
-    "Softmax": nn.Softmax(),
-    "LeakyReLU": nn.LeakyReLU(),
-    "PReLU": nn.PReLU(),
+    "ReLU": lambda: nn.ReLU(),
+    "Sigmoid": lambda: nn.Sigmoid(),
+    "Tanh": lambda: nn.Tanh(),
+    "Softmax": lambda: nn.Softmax(),
+    "LeakyReLU": lambda: nn.LeakyReLU(),
+    "PReLU": lambda: nn.PReLU(),
 }
 
 
@@ -94,7 +173,8 @@ LAYERS = {
     "GRU": lambda i, h_size: nn.GRU(i, h_size),
     "RNN": lambda i, h_size: nn.RNN(i, h_size),
     "Dropout": lambda p: nn.Dropout(p), # need to add functionality for dropout layer?
-    "Decoder": lambda embed_dim, heads, hidden_dim: nn.TransformerDecoderLayer(d_model=embed_dim, nhead=heads, dim_feedforward=hidden_dim, batch_first=True),# USE IMPORTED CLASS FOR CONSTRUCTING DECODER HERE
+    "Decoder": lambda embed_dim, heads, hidden_dim: CausalDecoderBlock(embed_dim, heads, hidden_dim),  # self-attention only, decoder-only LM
+    "LegacyDecoder": lambda embed_dim, heads, hidden_dim: nn.TransformerDecoderLayer(d_model=embed_dim, nhead=heads, dim_feedforward=hidden_dim, batch_first=True),  # self + cross attention over the same sequence (older models)
     "Output": lambda p: nn.Dropout(p),
     # Output: [nn.Dropout(p), nn.Linear(embed_dim, vocab_size)], # would need to also access Linear layer after the dropout. Linear dimensions will be (embed_dim, vocab_size)
 }
@@ -115,3 +195,32 @@ OPTIMIZERS = {
     "SGD": lambda model_params, lr: optim.SGD(model_params, lr),
     "RMSprop": lambda model_params, lr: optim.RMSprop(model_params, lr),
 }
+
+# server-wide caps on every training request, a request's "stopping" options can only go lower.
+# None = no cap
+TRAINING_LIMITS = {
+    "max_epochs": 100,
+    "max_seconds": 30 * 60,
+    "max_steps": None,
+}
+
+# shape of one sample (without the batch dimension) + what the last layer has to produce,
+# known up front so a layer spec can be checked without loading the dataset
+INPUT_SHAPES = {
+    "pima": (8,),
+    "MNIST": (1, 28, 28),
+    "FashionMNIST": (1, 28, 28),
+    "CIFAR10": (3, 32, 32),
+}
+NUM_CLASSES = {
+    "pima": 1,  # one probability, BCE
+    "MNIST": 10,
+    "FashionMNIST": 10,
+    "CIFAR10": 10,
+}
+
+# /train requests over these are rejected before anything is loaded
+PREFLIGHT_LIMITS = {
+    "max_params": 50_000_000,
+    "max_memory_bytes": 4 * 1024**3,  # params + grads + optimizer state + activations
+}
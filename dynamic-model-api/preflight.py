@@ -0,0 +1,118 @@
+import torch
+from torch.utils.flop_counter import FlopCounterMode
+
+from models import DynamicModel
+from params import ACTIVATIONS, INPUT_SHAPES, LAYERS, LOSSES, NUM_CLASSES, OPTIMIZERS, PREFLIGHT_LIMITS
+
+# tensors of optimizer state per parameter
+_OPTIMIZER_STATES = {"Adam": 2, "AdamW": 2, "RMSprop": 1, "SGD": 0}
+_BYTES = 4  # float32
+
+
+def _meta_model(layers):
+    with torch.device("meta"):  # shapes only, no memory allocated, no weights initialized
+        return DynamicModel(layers)
+
+
+def preflight(data, limits=PREFLIGHT_LIMITS):
+    """
+    Check a /train layer spec without loading data or allocating weights: every
+    layer is run on meta tensors of the dataset's known input shape. Reports
+    per-layer output shapes, parameters, forward FLOPs and activation memory for
+    the requested batch size, and whether the spec fits the server limits.
+
+    :param data: The /train request (input, layers, loss, optimizer, batch_size, epoch).
+    :param limits: See params.PREFLIGHT_LIMITS.
+    """
+    if not isinstance(data, dict):
+        return {"ok": False, "errors": ["The request body must be a JSON object"], "layers": []}
+    errors = []
+    inp = data.get("input")
+    batch_size = data.get("batch_size", 1)
+    if not isinstance(inp, str) or inp not in INPUT_SHAPES:
+        errors.append(f"Unknown input {inp!r}, expected one of {sorted(INPUT_SHAPES)}")
+    # bool is an int to Python, not to anyone sending JSON
+    if not isinstance(batch_size, int) or isinstance(batch_size, bool) or batch_size < 1:
+        errors.append(f"batch_size must be a positive integer, got {batch_size!r}")
+    epochs = data.get("epoch")
+    if not isinstance(epochs, int) or isinstance(epochs, bool) or epochs < 1:
+        errors.append(f"epoch must be a positive integer, got {epochs!r}")
+    if not isinstance(data.get("loss"), str) or data.get("loss") not in LOSSES:
+        errors.append(f"Unknown loss {data.get('loss')!r}")
+    optimizer = data.get("optimizer")
+    optimizer = optimizer.get("kind") if isinstance(optimizer, dict) else None  # {"kind", "lr"}
+    if not isinstance(optimizer, str) or optimizer not in OPTIMIZERS:
+        errors.append(f"Unknown optimizer {data.get('optimizer')!r}")
+    layers = data.get("layers")
+    if not isinstance(layers, list) or not layers:
+        errors.append(f"layers must be a non-empty list, got {layers!r}")
+        layers = []
+    for i, layer in enumerate(layers):
+        kind = layer.get("kind") if isinstance(layer, dict) else layer
+        if not isinstance(kind, str) or (kind not in LAYERS and kind not in ACTIVATIONS):
+            errors.append(f"Layer {i}: unknown kind {kind!r}")
+        elif not isinstance(layer, dict):
+            errors.append(f"Layer {i}: expected {{\"kind\": {kind!r}, ...}}, got {layer!r}")
+    if errors:
+        return {"ok": False, "errors": errors, "layers": []}
+
+    try:
+        model = _meta_model(data["layers"])
+    except Exception as e:  # e.g. wrong number of args
+        return {"ok": False, "errors": [f"Could not build the model: {e}"], "layers": []}
+
+    x = torch.empty((batch_size, *INPUT_SHAPES[inp]), device="meta")
+    report = []
+    activation_bytes = x.numel() * _BYTES
+    total_flops = 0
+    for i, (spec, layer) in enumerate(zip(data["layers"], model.layers)):
+        try:
+            with FlopCounterMode(display=False) as counter:
+                x = layer(x)
+        except Exception as e:
+            errors.append(f"Layer {i} ({spec['kind']}) can't take input of shape {list(x.shape)}: {e}")
+            break
+        if not isinstance(x, torch.Tensor):  # e.g. LSTM returns (output, state)
+            errors.append(f"Layer {i} ({spec['kind']}) returns a {type(x).__name__}, not a tensor")
+            break
+        flops = counter.get_total_flops()
+        total_flops += flops
+        activation_bytes += x.numel() * _BYTES  # kept for the backward pass
+        report.append(
+            {
+                "index": i,
+                "kind": spec["kind"],
+                "output_shape": list(x.shape),
+                "params": sum(p.numel() for p in layer.parameters()),
+                "flops": flops,
+                "activation_bytes": x.numel() * _BYTES,
+            }
+        )
+
+    if not errors:
+        expected = [batch_size, NUM_CLASSES[inp]]
+        if list(x.shape) != expected:
+            errors.append(f"Model output has shape {list(x.shape)}, {inp} needs {expected}")
+
+    params = sum(p.numel() for p in model.parameters())
+    # params + grads + optimizer state, plus every activation kept for backward
+    memory_bytes = params * _BYTES * (2 + _OPTIMIZER_STATES.get(optimizer, 2)) + activation_bytes
+    if params > limits["max_params"]:
+        errors.append(f"{params} parameters, the limit is {limits['max_params']}")
+    if memory_bytes > limits["max_memory_bytes"]:
+        errors.append(
+            f"Needs ~{memory_bytes / 1024**2:.0f} MiB for batch size {batch_size}, "
+            f"the limit is {limits['max_memory_bytes'] / 1024**2:.0f} MiB"
+        )
+
+    return {
+        "ok": not errors,
+        "errors": errors,
+        "layers": report,
+        "params": params,
+        "forward_flops": total_flops,
+        "train_flops_per_step": 3 * total_flops,  # forward + ~2x for backward
+        "activation_bytes": activation_bytes,
+        "memory_bytes": memory_bytes,
+        "batch_size": batch_size,
+    }
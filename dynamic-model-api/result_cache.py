@@ -0,0 +1,301 @@
+import copy
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import Future
+
+from weight_store import WEIGHTS
+
+# RESULTS of finished training requests, keyed by a hash of everything that affects them
+DB_PATH = "data/result_cache.sqlite"
+
+# request keys that change how a run is delivered, not what it computes
+_NOT_IN_KEY = ("job_id", "async", "stream", "emit_every", "log_every", "batch", "checkpoint", "cache")
+
+
+def spec_hash(kind, data):
+    """
+    Canonical hash of a training request: same kind + same payload (key order,
+    tuples vs lists don't matter) + same seed --> same hash.
+
+    :param kind: "train" or "transformertrain".
+    :param data: The request payload.
+    """
+    spec = {k: v for k, v in data.items() if k not in _NOT_IN_KEY}
+    spec["seed"] = data.get("seed")  # unseeded requests share one entry
+    canonical = json.dumps({"kind": kind, "spec": spec}, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+def cacheable(data):
+    # resumed runs continue a checkpoint, their result isn't a function of the request. checkpointed
+    # runs have to leave a checkpoint under their own job id, which a cached answer wouldn't
+    return data.get("cache", True) and not data.get("resume") and not data.get("checkpoint")
+
+
+class ResultCache:
+    """
+    In-memory LRU of training RESULTS with a time to live, backed by sqlite so
+    results survive restarts. Identical requests that arrive while the first one
+    is still training wait for its result instead of training again.
+
+    :param max_entries: Results kept in memory (least recently used dropped first).
+    :param ttl: Seconds a result stays valid, in memory and on disk.
+    :param db_path: sqlite file of the persistent store (None = memory only).
+    """
+
+    def __init__(self, max_entries=256, ttl=7 * 24 * 3600, db_path=DB_PATH):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.db_path = db_path
+        self.entries = OrderedDict()  # key -> (RESULTS, created_at, training seconds)
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0  # requests that waited on an identical run in flight
+        self.saved_seconds = 0.0  # training time not spent thanks to hits + coalescing
+        self._in_flight = {}  # key -> Future of (RESULTS, seconds)
+        self._lock = threading.Lock()
+        if db_path is not None:
+            os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+            with self._db() as db:
+                db.execute(
+                    "CREATE TABLE IF NOT EXISTS results "
+                    "(key TEXT PRIMARY KEY, kind TEXT, results TEXT, created_at REAL, seconds REAL)"
+                )
+
+    def run(self, kind, data, train):
+        """
+        RESULTS for the request: from the cache, from an identical run in flight,
+        or from train() (then cached).
+
+        :param kind: "train" or "transformertrain".
+        :param data: The request payload.
+        :param train: Function that trains and returns RESULTS.
+        """
+        if not cacheable(data):
+            return train()
+        key = spec_hash(kind, data)
+        status, value = self._lookup(key)
+        if status == "hit":
+            return self._tag(value[0], key, "hit", data)
+        if status == "coalesced":
+            return self._wait(key, value, data)
+
+        start = time.perf_counter()
+        try:
+            results = train()
+        except Exception as e:
+            self._failed(key, value, e)
+            raise
+        self._trained(key, kind, value, results, time.perf_counter() - start)
+        return self._tag(results, key, "miss", data)
+
+    def run_group(self, kind, datas, callbacks, train_group):
+        """
+        run() for a group of batched requests: only the ones that aren't cached or
+        already in flight (including earlier duplicates in the same group) are
+        trained, in one train_group() call, and each of their RESULTS is cached.
+
+        :param kind: "train".
+        :param datas: The requests.
+        :param callbacks: One callback (or None) per request.
+        :param train_group: function(datas, callbacks) returning one RESULTS per request.
+        :return: One RESULTS per request, in the same order.
+        """
+        out = [None] * len(datas)
+        leaders, waiting = [], []  # (index, key, Future), key + Future are None if not cacheable
+        for i, data in enumerate(datas):
+            if not cacheable(data):
+                leaders.append((i, None, None))
+                continue
+            key = spec_hash(kind, data)
+            status, value = self._lookup(key)
+            if status == "hit":
+                out[i] = self._tag(value[0], key, "hit", data)
+            elif status == "coalesced":
+                waiting.append((i, key, value))
+            else:
+                leaders.append((i, key, value))
+
+        if leaders:
+            start = time.perf_counter()
+            try:
+                results = train_group(
+                    [datas[i] for i, _, _ in leaders], [callbacks[i] for i, _, _ in leaders]
+                )
+            except Exception as e:
+                for _, key, flight in leaders:
+                    if flight is not None:
+                        self._failed(key, flight, e)
+                raise
+            seconds = time.perf_counter() - start  # what every job in the group waited for
+            for (i, key, flight), result in zip(leaders, results):
+                if flight is None:
+                    out[i] = result
+                else:
+                    self._trained(key, kind, flight, result, seconds)
+                    out[i] = self._tag(result, key, "miss", datas[i])
+
+        # after our own runs are settled, so two groups waiting on each other can't deadlock
+        for i, key, flight in waiting:
+            try:
+                out[i] = self._wait(key, flight, datas[i])
+            except Exception as e:  # the run we waited on failed, the rest of the group didn't
+                out[i] = {"error": str(e)}
+        return out
+
+    def wrap(self, runners):
+        # kind -> function(data, callback) with the cache in front, drop-in for runners.RUNNERS
+        return {
+            kind: (lambda data, callback=None, kind=kind, run=run: self.run(kind, data, lambda: run(data, callback)))
+            for kind, run in runners.items()
+        }
+
+    def wrap_batch(self, batch_runners):
+        # same for the job queue's batch_runners. cached requests get no group key, so they skip
+        # the batching window and are answered by the (wrapped) regular runner right away
+        def group_key(kind, key, data):
+            if cacheable(data) and self.get(spec_hash(kind, data)) is not None:
+                return None
+            return key(data)
+
+        return {
+            kind: (
+                lambda data, kind=kind, key=key: group_key(kind, key, data),
+                lambda datas, callbacks, kind=kind, run=run: self.run_group(kind, datas, callbacks, run),
+            )
+            for kind, (key, run) in batch_runners.items()
+        }
+
+    def get(self, key):
+        # (RESULTS, training seconds) or None if missing / expired
+        now = time.time()
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                if now - entry[1] <= self.ttl:
+                    self.entries.move_to_end(key)
+                    return entry[0], entry[2]
+                del self.entries[key]
+        if self.db_path is None:
+            return None
+        with self._db() as db:
+            row = db.execute(
+                "SELECT results, created_at, seconds FROM results WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None or now - row[1] > self.ttl:
+            return None
+        results = json.loads(row[0])
+        self._remember(key, results, row[1], row[2])
+        return results, row[2]
+
+    def put(self, key, kind, results, seconds):
+        created_at = time.time()
+        self._remember(key, results, created_at, seconds)
+        if self.db_path is not None:
+            with self._db() as db:
+                db.execute(
+                    "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?)",
+                    (key, kind, json.dumps(results), created_at, seconds),
+                )
+                db.execute("DELETE FROM results WHERE created_at < ?", (created_at - self.ttl,))
+
+    def stats(self):
+        with self._lock:
+            requests = self.hits + self.misses + self.coalesced
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "hit_rate": (self.hits + self.coalesced) / requests if requests else 0.0,
+                "saved_seconds": self.saved_seconds,
+                "in_flight": len(self._in_flight),
+                "entries": len(self.entries),
+            }
+
+    def _lookup(self, key):
+        # ("hit", (RESULTS, seconds)), ("coalesced", Future of a run in flight) or
+        # ("miss", Future) --> the caller trains and settles it with _trained / _failed
+        cached = self.get(key)
+        if cached is not None:
+            with self._lock:
+                self.hits += 1
+                self.saved_seconds += cached[1]
+            return "hit", cached
+        with self._lock:
+            flight = self._in_flight.get(key)
+            if flight is not None:
+                self.coalesced += 1
+                return "coalesced", flight
+            flight = self._in_flight[key] = Future()
+        return "miss", flight
+
+    def _wait(self, key, flight, data):
+        results, seconds = flight.result()  # raises if the run we waited on failed
+        with self._lock:
+            self.saved_seconds += seconds
+        return self._tag(results, key, "coalesced", data)
+
+    def _trained(self, key, kind, flight, results, seconds):
+        if "error" not in results:
+            self.put(key, kind, results, seconds)
+        flight.set_result((results, seconds))
+        self._landed(key)
+
+    def _failed(self, key, flight, e):
+        flight.set_exception(e)
+        self._landed(key)
+
+    def _landed(self, key):
+        with self._lock:
+            self._in_flight.pop(key, None)
+            self.misses += 1
+
+    def _remember(self, key, results, created_at, seconds):
+        with self._lock:
+            self.entries[key] = (results, created_at, seconds)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def _tag(self, results, key, status, data):
+        # copy, so the cached RESULTS are never changed by whoever gets them
+        results = copy.deepcopy(results)
+        results["cache"] = {"status": status, "key": key}
+        if status != "miss":
+            # answered by another job's run: give it its own id + a copy of that run's weights,
+            # so "warm_start" from it works like from any other finished job
+            source = results.get("job_id")
+            job_id = data.get("job_id") or uuid.uuid4().hex
+            if source and source != job_id:
+                WEIGHTS.copy(source, job_id)
+                results["cache"]["job_id"] = source
+            results["job_id"] = job_id
+            results.pop("checkpoint", None)  # that run's checkpoint, not this job's
+        return results
+
+    def _db(self):
+        # a connection per use, sqlite connections can't be shared between threads
+        return _Connection(self.db_path)
+
+
+class _Connection:
+    # sqlite3 connection that commits and closes on exit (sqlite3's own context manager doesn't close)
+    def __init__(self, path):
+        self.conn = sqlite3.connect(path, timeout=10)
+
+    def __enter__(self):
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.conn.commit()
+        self.conn.close()
+
+
+RESULT_CACHE = ResultCache()
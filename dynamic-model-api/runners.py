@@ -0,0 +1,262 @@
+import contextlib
+import random
+import threading
+import uuid
+
+import numpy as np
+import torch
+
+from checkpoint import Checkpointer, rng_state, set_rng_state
+from compile_cache import COMPILE_CACHE
+from models import DynamicModel, Train, TransformerModel, TransformerTrain, TRANSFORMER_DATA
+from params import INPUT_SHAPES
+from stopping import StoppingPolicy
+from weight_store import WEIGHTS, spec_signature
+
+# the body of /train and /transformertrain, shared by the synchronous endpoints and the job queue.
+# callback(metrics) is called once per epoch with that epoch's numbers, and every
+# data["log_every"] batches with running batch numbers if that's set
+
+
+class SharedExclusiveLock:
+    """
+    Any number of shared holders at once, or a single exclusive one. A waiting
+    exclusive holder goes before new shared ones, so it can't be starved.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._shared = 0
+        self._exclusive = False
+        self._waiting = 0  # exclusive holders waiting
+
+    @contextlib.contextmanager
+    def shared(self):
+        with self._cond:
+            self._cond.wait_for(lambda: not self._exclusive and not self._waiting)
+            self._shared += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._shared -= 1
+                self._cond.notify_all()
+
+    @contextlib.contextmanager
+    def exclusive(self):
+        with self._cond:
+            self._waiting += 1
+            self._cond.wait_for(lambda: not self._exclusive and not self._shared)
+            self._waiting -= 1
+            self._exclusive = True
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._exclusive = False
+                self._cond.notify_all()
+
+
+# torch / python / numpy's RNGs are process-global and every run draws from them all the time
+# (init, shuffling, dropout), so a concurrent job would change a seeded run's numbers
+RNG_LOCK = SharedExclusiveLock()
+
+
+@contextlib.contextmanager
+def seeded(data):
+    # "seed": n --> same request, same RESULTS (which is what makes them safe to cache). a seeded run
+    # has the process to itself: it waits for the runs in progress and new ones wait for it. the RNG
+    # state from before is restored after, so seeding doesn't leak into later unseeded runs
+    seed = data.get("seed")
+    if seed is None:
+        with RNG_LOCK.shared():
+            yield
+        return
+    with RNG_LOCK.exclusive():
+        state = rng_state()
+        torch.manual_seed(seed)
+        random.seed(seed)
+        np.random.seed(seed)
+        try:
+            yield
+        finally:
+            set_rng_state(state)
+
+
+@contextlib.contextmanager
+def checkpointing(kind, data, job_id):
+    # (checkpointer, checkpoint to resume from), both None unless the request has "checkpoint".
+    # the checkpointer's writer thread is stopped when the run ends, also when it fails (then
+    # without a "finished" checkpoint, so the job can still be resumed)
+    if data.get("checkpoint") and not data.get("job_id"):
+        # a made up id would only reach the client with the RESULTS, too late to resume anything
+        raise ValueError('"checkpoint" needs a job id, submit the request as a job ("async": true)')
+    checkpointer = Checkpointer.from_request(kind, data, job_id)
+    try:
+        if checkpointer is None or not data.get("resume"):
+            yield checkpointer, None
+        else:
+            yield checkpointer, checkpointer.load()  # None if it crashed before the first checkpoint
+    finally:
+        if checkpointer is not None:
+            checkpointer.close()  # no-op if the loop already closed it with its final state
+
+
+def warm_start(kind, data, model):
+    # load the final weights of the job in data["warm_start"] into model,
+    # returns how many epochs went into them (0 without a warm start)
+    source = data.get("warm_start")
+    if not source:
+        return 0
+    entry = WEIGHTS.get(source)
+    if entry is None:
+        raise ValueError(f"No stored weights for job {source} (not finished, or evicted)")
+    if entry["signature"] != spec_signature(kind, data):
+        raise ValueError(f"Job {source} was trained with different layers or input")
+    model.load_state_dict(entry["model"])
+    print(f"Warm start from job {source} ({entry['epochs_trained']} epochs)")
+    return entry["epochs_trained"]
+
+
+def remaining_epochs(data, epochs_before):
+    # "epoch" is the total the client wants, a warm start only trains the ones it doesn't have yet
+    n_epochs = data["epoch"] - epochs_before
+    if n_epochs <= 0:
+        raise ValueError(
+            f"Job {data['warm_start']} already trained {epochs_before} epochs, "
+            f"ask for more than that to keep training (\"epoch\" is the total)"
+        )
+    return n_epochs
+
+
+def finish(kind, data, job_id, model, results, epochs_before):
+    # keep the weights around for later warm starts, and tell the client which id they're under
+    epochs_total = epochs_before + results["epochs_run"]
+    WEIGHTS.put(job_id, spec_signature(kind, data), model, epochs_total)
+    results["job_id"] = job_id
+    results["epochs_total"] = epochs_total  # incl. the warm start's
+    if data.get("warm_start"):
+        results["warm_start"] = {"job_id": data["warm_start"], "epochs_before": epochs_before}
+    return results
+
+
+def run_train(data, callback=None):
+    inp = data["input"]
+    layers = data["layers"]
+    loss = data["loss"]
+    optimizer = data["optimizer"]
+    batch_size = data["batch_size"]
+    fast_data = data.get("fast_data", False)  # opt-in cached tensor path for image datasets
+    log_every = data.get("log_every", 0)
+    autotune = data.get("autotune_loader", False)  # pick DataLoader workers/prefetching by benchmark
+    eval_every = data.get("eval_every", 1)
+    eval_subsample = data.get("eval_subsample")  # e.g. 2000 --> stratified, same samples every epoch
+    compile = data.get("compile", False)  # torch.compile, shared by every job with the same layers + input
+    # e.g. {"patience": 3, "max_seconds": 300}, capped by params.TRAINING_LIMITS
+    stopping = StoppingPolicy.from_request(data.get("stopping"))
+    # set by the job queue, synchronous requests get a fresh one
+    job_id = data.get("job_id") or uuid.uuid4().hex
+    # e.g. {"every_steps": 500} or {"every_seconds": 60}
+    with checkpointing("train", data, job_id) as (checkpointer, resume), seeded(data):
+        model = DynamicModel(layers)
+        epochs_before = warm_start("train", data, model)  # "warm_start": id of a finished job
+        n_epochs = remaining_epochs(data, epochs_before)
+        compile_info = None
+        trained = model
+        if compile:
+            trained, compile_info = COMPILE_CACHE.wrap(model, layers, INPUT_SHAPES[inp], batch_size)
+
+        t = Train(
+            model=trained,
+            input=inp,
+            loss=loss,
+            optimizer=optimizer,
+            batch_size=batch_size,
+            fast_data=fast_data,
+            autotune=autotune,
+            eval_every=eval_every,
+            eval_subsample=eval_subsample,
+        )
+
+        print("slay... model initialized successfully!")
+        results = t.train_test_log(
+            n_epochs,
+            batch_size,
+            callback=callback,
+            log_every=log_every,
+            stopping=stopping,
+            checkpointer=checkpointer,
+            resume=resume,
+        )
+        if compile_info is not None:
+            results["compile"] = compile_info
+        return finish("train", data, job_id, model, results, epochs_before)
+
+
+def run_transformer_train(data, callback=None):
+    inp = data["input"]
+    layers = data["layers"]
+    loss = data["loss"]
+    optimizer = data["optimizer"]
+    batch_size = data["batch_size"]
+    streaming = data.get("streaming", False)  # read the corpus in chunks instead of all at once
+    num_workers = data.get("num_workers", 0)
+    # fewer windows per epoch --> comparable loss in a fraction of the time
+    stride = data.get("stride", 1)
+    sampling = data.get("sampling", "stride")  # or "random" with windows_per_epoch
+    windows_per_epoch = data.get("windows_per_epoch")
+    log_every = data.get("log_every", 0)
+    autotune = data.get("autotune_loader", False)  # overrides num_workers
+    stopping = StoppingPolicy.from_request(data.get("stopping"))  # monitors train loss
+    job_id = data.get("job_id") or uuid.uuid4().hex
+    # > 1 --> DistributedDataParallel over that many local processes, batch_size is split between them
+    processes = data.get("processes", 1)
+    if processes > 1 and data.get("checkpoint"):
+        raise ValueError("Checkpoints aren't supported with processes > 1")
+    with checkpointing("transformertrain", data, job_id) as (checkpointer, resume), seeded(data):
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()  # clear GPU memory
+
+        # built once per process, shared with the trainer
+        dataset = TRANSFORMER_DATA[f"{inp}:stream" if streaming else inp]
+        model = TransformerModel(
+            layers, dataset.vocab_size, dataset.sequence_length
+        )  # model is moved to device in train function
+        epochs_before = warm_start("transformertrain", data, model)
+        n_epochs = remaining_epochs(data, epochs_before)
+        if processes > 1:
+            from distributed import train_distributed
+
+            results = train_distributed(model, dict(data, epoch=n_epochs), processes, callback=callback)
+            return finish("transformertrain", data, job_id, model, results, epochs_before)
+
+        t = TransformerTrain(
+            model=model,
+            inp=inp,
+            loss=loss,
+            optimizer=optimizer,
+            batch_size=batch_size,
+            dataset=dataset,
+            num_workers=num_workers,
+            stride=stride,
+            sampling=sampling,
+            windows_per_epoch=windows_per_epoch,
+            autotune=autotune,
+        )
+
+        print("it worked!")
+        results = t.train(
+            n_epochs,
+            callback=callback,
+            log_every=log_every,
+            stopping=stopping,
+            checkpointer=checkpointer,
+            resume=resume,
+        )
+        return finish("transformertrain", data, job_id, model, results, epochs_before)
+
+
+RUNNERS = {
+    "train": run_train,
+    "transformertrain": run_transformer_train,
+}
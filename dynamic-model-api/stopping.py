@@ -0,0 +1,132 @@
+import math
+import time
+
+from params import TRAINING_LIMITS
+
+
+class StoppingPolicy:
+    """
+    Decides when a training loop should stop before running all requested
+    epochs: no improvement for `patience` epochs, out of wall-clock time, or out
+    of optimizer steps. The training loops call step() after every batch and
+    epoch_end() after every epoch, and report `reason` in RESULTS.
+
+    :param patience: Stop after this many epochs without improvement (None = never).
+    :param min_delta: Smallest decrease of the monitored loss that counts as improvement.
+    :param monitor: "test_loss" or "train_loss" (default: test loss when the loop has one).
+    :param max_seconds: Wall-clock budget for the whole run, checked after every batch.
+    :param max_steps: Optimizer step budget for the whole run.
+    """
+
+    def __init__(self, patience=None, min_delta=0.0, monitor=None, max_seconds=None, max_steps=None):
+        if monitor not in (None, "test_loss", "train_loss"):
+            raise ValueError(f"Unknown monitor {monitor!r}, use test_loss or train_loss")
+        self.patience = patience
+        self.min_delta = min_delta
+        self.monitor = monitor
+        self.max_seconds = max_seconds
+        self.max_steps = max_steps
+        self.max_epochs = None  # server cap, see from_request()
+        self.epoch_capped = False
+
+        self.reason = None  # why training stopped early, None while it's still going
+        self.steps = 0
+        self.best = math.inf
+        self.best_epoch = None
+        self.bad_epochs = 0
+        self.started_at = time.perf_counter()
+
+    @classmethod
+    def from_request(cls, options=None, limits=TRAINING_LIMITS):
+        """
+        Build the policy for a request's "stopping" options, with the server-wide
+        limits applied on top (a request can ask for less, never for more).
+
+        :param options: e.g. {"patience": 3, "min_delta": 0.001, "max_seconds": 600}
+        :param limits: Server caps, see params.TRAINING_LIMITS.
+        """
+        options = dict(options or {})
+        for key in ("max_seconds", "max_steps"):
+            cap = limits.get(key)
+            if cap is not None:
+                options[key] = min(options.get(key) or cap, cap)
+        policy = cls(**options)
+        policy.max_epochs = limits.get("max_epochs")
+        return policy
+
+    def start(self, n_epochs):
+        # called by the loop right before the first batch, returns the epochs it should schedule
+        self.started_at = time.perf_counter()  # dataset loading doesn't eat into max_seconds
+        if self.max_epochs is not None and n_epochs > self.max_epochs:
+            self.epoch_capped = True
+            return self.max_epochs
+        return n_epochs
+
+    def step(self):
+        """Count one optimizer step. True if a budget ran out and the loop should stop now."""
+        self.steps += 1
+        if self.max_steps is not None and self.steps >= self.max_steps:
+            self.reason = "max_steps"
+        elif self.max_seconds is not None and self.elapsed() >= self.max_seconds:
+            self.reason = "max_seconds"
+        return self.reason is not None
+
+    def epoch_end(self, epoch, metrics):
+        """
+        Update patience with this epoch's losses. True if training should stop.
+
+        :param epoch: Epoch number (1-based).
+        :param metrics: {"train_loss": ..., "test_loss": ...}, test_loss None if it wasn't evaluated.
+        """
+        if self.reason is not None:
+            return True
+        monitor = self.monitor or ("test_loss" if "test_loss" in metrics else "train_loss")
+        value = metrics.get(monitor)
+        if self.patience is not None and value is not None:  # epochs without a test pass don't count
+            if value < self.best - self.min_delta:
+                self.best = value
+                self.best_epoch = epoch
+                self.bad_epochs = 0
+            else:
+                self.bad_epochs += 1
+                if self.bad_epochs >= self.patience:
+                    self.reason = "early_stopping"
+        return self.reason is not None
+
+    def elapsed(self):
+        return time.perf_counter() - self.started_at
+
+    def stop_reason(self):
+        # for RESULTS, once the loop is done
+        if self.reason is not None:
+            return self.reason
+        return "max_epochs" if self.epoch_capped else "completed"
+
+    def state_dict(self):
+        # for checkpoints, a resumed run picks up the same patience and budgets
+        return {
+            "reason": self.reason,
+            "steps": self.steps,
+            "best": self.best,
+            "best_epoch": self.best_epoch,
+            "bad_epochs": self.bad_epochs,
+            "elapsed": self.elapsed(),
+        }
+
+    def load_state_dict(self, state):
+        # call after start(), the time already spent still counts towards max_seconds
+        self.reason = state["reason"]
+        self.steps = state["steps"]
+        self.best = state["best"]
+        self.best_epoch = state["best_epoch"]
+        self.bad_epochs = state["bad_epochs"]
+        self.started_at = time.perf_counter() - state["elapsed"]
+
+    def summary(self, epochs_run):
+        return {
+            "stop_reason": self.stop_reason(),
+            "epochs_run": epochs_run,
+            "steps_run": self.steps,
+            "best_epoch": self.best_epoch,
+            "elapsed_seconds": self.elapsed(),
+        }
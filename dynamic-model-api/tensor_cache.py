@@ -0,0 +1,107 @@
+import math
+import os
+import threading
+
+import numpy as np
+import torch
+from torch.utils.data import TensorDataset
+
+from files import write_atomic
+
+# preprocessed image datasets live next to the torchvision downloads
+CACHE_DIR = "data/tensor_cache"
+
+_TENSORS = {}  # (cache name, device) -> (images, labels)
+_lock = threading.Lock()
+
+
+def cache_name(dataset):
+    # e.g. MNIST_train / CIFAR10_test
+    split = "train" if getattr(dataset, "train", True) else "test"
+    return f"{type(dataset).__name__}_{split}"
+
+
+def to_uint8(dataset):
+    """
+    Convert a torchvision image dataset into one contiguous uint8 tensor of shape
+    [N, C, H, W] plus an int64 label tensor, without going through PIL.
+
+    :param dataset: torchvision dataset whose transform is just ToTensor().
+    """
+    data = getattr(dataset, "data", None)
+    if isinstance(data, torch.Tensor):  # MNIST / FashionMNIST --> [N, H, W]
+        images = data
+    elif isinstance(data, np.ndarray):  # CIFAR10 --> [N, H, W, C]
+        images = torch.from_numpy(data)
+    else:  # unknown layout, run the dataset's own transform once per sample
+        images = torch.stack(
+            [(dataset[i][0] * 255).round().to(torch.uint8) for i in range(len(dataset))]
+        )
+
+    if images.dim() == 3:  # grayscale, add channel dim
+        images = images.unsqueeze(1)
+    elif images.shape[-1] in (1, 3) and images.shape[1] not in (1, 3):  # channels last
+        images = images.permute(0, 3, 1, 2)
+
+    labels = torch.as_tensor(dataset.targets, dtype=torch.int64)
+    return images.contiguous(), labels
+
+
+def load_tensors(dataset):
+    """Load the uint8 tensors for a dataset from disk, building the cache file the first time."""
+    path = os.path.join(CACHE_DIR, cache_name(dataset) + ".pt")
+    if os.path.exists(path):
+        cached = torch.load(path, weights_only=True)
+        return cached["images"], cached["labels"]
+
+    images, labels = to_uint8(dataset)
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    # atomic, so other workers never see half a file
+    write_atomic(path, lambda f: torch.save({"images": images, "labels": labels}, f))
+    print(f"Cached {cache_name(dataset)} tensors to {path}")
+    return images, labels
+
+
+def cached_tensors(dataset, device):
+    """Device resident (images, labels) for a dataset, shared by everything in this process."""
+    key = (cache_name(dataset), str(device))
+    with _lock:
+        if key not in _TENSORS:
+            images, labels = load_tensors(dataset)
+            _TENSORS[key] = (images.to(device), labels.to(device))
+        return _TENSORS[key]
+
+
+class TensorBatchLoader:
+    """
+    Stand-in for DataLoader over the cached uint8 tensors. Batches are picked by
+    index permutation and scaled to [0, 1] in one op, same as ToTensor() does.
+
+    :param images: uint8 tensor [N, C, H, W].
+    :param labels: int64 tensor [N].
+    :param batch_size: Number of samples per batch.
+    :param shuffle: Reshuffle the sample order every epoch.
+    """
+
+    def __init__(self, images, labels, batch_size, shuffle=False):
+        self.images = images
+        self.labels = labels
+        self.dataset = TensorDataset(images, labels)  # so len(loader.dataset) works like a DataLoader
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+
+    def __len__(self):
+        return math.ceil(len(self.labels) / self.batch_size)
+
+    def __iter__(self):
+        n = len(self.labels)
+        order = torch.randperm(n, device=self.images.device) if self.shuffle else None
+        for start in range(0, n, self.batch_size):
+            if order is None:
+                X = self.images[start : start + self.batch_size]
+                y = self.labels[start : start + self.batch_size]
+            else:
+                idx = order[start : start + self.batch_size]
+                X = self.images.index_select(0, idx)
+                y = self.labels.index_select(0, idx)
+            yield X.float().div_(255), y
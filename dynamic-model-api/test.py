@@ -91,3 +91,50 @@ except:
 #     print(f"Response: {response.json()}")
 # except:
 #     print("url not found")
+
+
+
+
+# ------ for testing that models trained at the same time don't share layers ------
+# (runs locally, no server needed) half the models train, the other half have lr=0 and
+# must come out with exactly the weights they started with
+import threading
+
+import torch
+
+from models import DynamicModel, Train
+
+layers = [
+    {"kind": "Linear", "args": (8, 12)},
+    {"kind": "PReLU"},  # has its own weight
+    {"kind": "Linear", "args": (12, 1)},
+    {"kind": "Sigmoid"},
+]
+trained = [DynamicModel(layers) for _ in range(4)]
+frozen = [DynamicModel(layers) for _ in range(4)]
+start_weights = [{k: v.clone() for k, v in m.state_dict().items()} for m in frozen]
+
+
+def train_model(model, lr):
+    t = Train(model, "pima", "BCE", {"kind": "SGD", "lr": lr}, batch_size=10)
+    t.train_test_log(2, 10)
+
+
+threads = [threading.Thread(target=train_model, args=(m, 0.1)) for m in trained]
+threads += [threading.Thread(target=train_model, args=(m, 0.0)) for m in frozen]
+for thread in threads:
+    thread.start()
+for thread in threads:
+    thread.join()
+
+all_params = [p for m in trained + frozen for p in m.parameters()]
+shared = len(all_params) - len({id(p) for p in all_params})
+changed = [
+    k
+    for m, before in zip(frozen, start_weights)
+    for k, v in m.state_dict().items()
+    if not torch.equal(v.cpu(), before[k].cpu())
+]
+print(f"shared parameters between models: {shared}")
+print(f"frozen weights changed by other jobs: {changed}")
+print("isolation OK" if not shared and not changed else "ISOLATION BROKEN")
@@ -0,0 +1,116 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+
+import torch
+
+from files import write_atomic
+
+WEIGHTS_DIR = "data/weights"
+MAX_BYTES = 2 * 1024**3  # oldest (least recently used) weights are deleted past this
+
+
+def spec_signature(kind, data):
+    # weights only fit a model built from the same layers on the same input
+    spec = {"kind": kind, "input": data["input"], "layers": data["layers"]}
+    return hashlib.sha256(json.dumps(spec, sort_keys=True).encode()).hexdigest()[:16]
+
+
+class WeightStore:
+    """
+    Final weights of finished jobs on disk, one file per job id, so a later
+    request with the same layers can start from them ("warm_start": job_id).
+    Bounded by size: when the folder grows past max_bytes the least recently
+    used files go first (reading a file touches its mtime). Shared by every
+    process that uses the same folder.
+
+    :param directory: Folder the weight files live in.
+    :param max_bytes: Size limit of the folder.
+    """
+
+    def __init__(self, directory=WEIGHTS_DIR, max_bytes=MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+    def path(self, job_id):
+        return os.path.join(self.directory, f"{job_id}.pt")
+
+    def put(self, job_id, signature, model, epochs_trained):
+        """
+        :param job_id: Job the weights came from.
+        :param signature: spec_signature() of that job.
+        :param model: The trained model.
+        :param epochs_trained: Epochs behind these weights, warm starts included.
+        """
+        entry = {
+            "signature": signature,
+            "epochs_trained": epochs_trained,
+            "model": {k: v.detach().cpu() for k, v in model.state_dict().items()},
+        }
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.path(job_id)
+        write_atomic(path, lambda f: torch.save(entry, f))
+        with self._lock:
+            self._evict()
+
+    def copy(self, source_id, job_id):
+        # the weights of source_id stored again under job_id, False if source_id isn't stored (anymore)
+        try:
+            with open(self.path(source_id), "rb") as source:
+                write_atomic(self.path(job_id), lambda f: shutil.copyfileobj(source, f))
+        except FileNotFoundError:
+            return False
+        with self._lock:
+            self._evict()
+        return True
+
+    def get(self, job_id):
+        # {"signature", "epochs_trained", "model"}, None if the job never finished or was evicted
+        path = self.path(job_id)
+        try:
+            entry = torch.load(path, map_location="cpu", weights_only=True)
+            os.utime(path)  # counts as a use for the LRU order
+        except FileNotFoundError:
+            return None
+        return entry
+
+    def stats(self):
+        files = self._files()
+        return {
+            "jobs": len(files),
+            "bytes": sum(size for _, size, _ in files),
+            "max_bytes": self.max_bytes,
+        }
+
+    def _files(self):
+        # (path, size, mtime) of every stored job
+        if not os.path.isdir(self.directory):
+            return []
+        files = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".pt"):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.directory, name))
+            except FileNotFoundError:  # evicted by another process just now
+                continue
+            files.append((os.path.join(self.directory, name), stat.st_size, stat.st_mtime))
+        return files
+
+    def _evict(self):
+        files = sorted(self._files(), key=lambda f: f[2])  # least recently used first
+        total = sum(size for _, size, _ in files)
+        for path, size, _ in files[:-1]:  # never evict the newest, even if it alone is too big
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+
+WEIGHTS = WeightStore()